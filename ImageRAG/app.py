@@ -3,7 +3,10 @@
 
 import streamlit as st
 import os
-from ImageRAG.rag_claude import RAGClaudeProcessor
+import uuid
+from ImageRAG.rag_claude import RAGClaudeProcessor, index_pdf_job
+from common.documents import document_id
+from common.jobs import get_job_manager, poll_job
 
 # Initialize the RAGClaudeProcessor
 def main():
@@ -18,23 +21,40 @@ def main():
     # File uploader
     uploaded_file = st.file_uploader("Choose a PDF file", type="pdf")
     if uploaded_file is not None:
-        # Save the uploaded file
-        pdf_path = os.path.join("uploads", uploaded_file.name)
-        with open(pdf_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
+        # Save the uploaded file once per content; reruns must not rewrite it while the
+        # indexing job is reading it
+        pdf_bytes = uploaded_file.getvalue()
+        pdf_path = os.path.join("uploads", f"{document_id(pdf_bytes)}.pdf")
+        if not os.path.exists(pdf_path):
+            tmp_path = f"{pdf_path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(pdf_bytes)
+            os.replace(tmp_path, pdf_path)
         st.success(f"File {uploaded_file.name} successfully uploaded!")
-        # Index the PDF
-        with st.spinner("Indexing PDF..."):
-            processor.index_pdf(pdf_path)
+        # Index the PDF on a job thread; reruns poll until it is done
+        if processor.indexed_pdf != pdf_path:
+            job_id = st.session_state.get("index_job")
+            if job_id is None or st.session_state.get("index_job_path") != pdf_path:
+                job_id = get_job_manager().submit(
+                    index_pdf_job, processor, pdf_path, kind="thread", label="ColPali indexing"
+                )
+                st.session_state["index_job"] = job_id
+                st.session_state["index_job_path"] = pdf_path
+            status = poll_job(job_id, label="Indexing PDF...")
+            get_job_manager().forget(job_id)
+            st.session_state["index_job"] = None
+            if status["status"] != "done":
+                st.error(f"Indexing failed: {status['error'] or status['status']}")
+                return
         st.success("PDF indexed successfully!")
         # Text input for the query
         query = st.text_input("Enter your query about the PDF:")
         if st.button("Process Query"):
             if query:
-                with st.spinner("Processing query..."):
-                    result = processor.process_query(query)
+                with st.spinner("Searching the document..."):
+                    answer = processor.process_query_stream(query)
                 st.subheader("Result:")
-                st.write(result)
+                st.write_stream(answer)
             else:
                 st.warning("Please enter a query.")
     # Clean up: remove uploaded files when the app is closed
@@ -1,54 +1,69 @@
-import boto3
-import json
-from pdf2image import convert_from_path
+import threading
 from byaldi import RAGMultiModalModel
-import os
 from dotenv import load_dotenv
 import base64
 from io import BytesIO
+from common.bedrock import get_bedrock_client, invoke_model, invoke_model_stream
+from common.documents import documents
+from common.llm_cache import llm_cache, make_key
+from common.metrics import track_request, track_stage
+from common.scheduler import INTERACTIVE, scheduler
+from common.usage import budget, estimate_tokens, usage_tracker
+
+MODEL_ID = 'anthropic.claude-3-5-sonnet-20240620-v1:0'
+# Resolution of the page image sent along with a query
+RENDER_DPI = 200
 
 load_dotenv()  # Load environment variables from .env file
 
 class RAGClaudeProcessor:
     def __init__(self):
         self.initialize_rag_engine()
-        # Initialize the AWS Bedrock client
-        self.bedrock = boto3.client(
-            service_name='bedrock-runtime',
-            region_name=os.getenv('AWS_REGION'),
-            aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-            aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY')
-        )
+        # Use the shared AWS Bedrock client
+        self.bedrock = get_bedrock_client()
         self.indexed_pdf = None
-        self.pdf_images = None
+        self.doc_id = None
+        # The processor is shared by all sessions and indexing runs on a job thread
+        self._lock = threading.RLock()
 
     def initialize_rag_engine(self):
         # Load the RAG engine model
         self.rag_engine = RAGMultiModalModel.from_pretrained("vidore/colpali")
 
     def index_pdf(self, pdf_path):
-        if self.indexed_pdf != pdf_path:
-            # Reinitialize the RAG engine to reset the index
-            self.initialize_rag_engine()
-
-            # Index the document
-            self.rag_engine.index(
-                input_path=pdf_path,
-                index_name="index",
-                store_collection_with_index=False,
-                overwrite=True
-            )
-
-            # Convert PDF to images
-            self.pdf_images = convert_from_path(pdf_path)
-            self.indexed_pdf = pdf_path
+        with self._lock:
+            if self.indexed_pdf != pdf_path:
+                # Reinitialize the RAG engine to reset the index
+                self.initialize_rag_engine()
+
+                # Index the document
+                with track_stage("image_rag", "rag_engine_index"):
+                    self.rag_engine.index(
+                        input_path=pdf_path,
+                        index_name="index",
+                        store_collection_with_index=False,
+                        overwrite=True
+                    )
+
+                # Pages are rendered on demand by the shared document service
+                self.doc_id = documents.register(pdf_path)
+                self.indexed_pdf = pdf_path
 
     def process_query(self, query):
+        # Query Claude with the constructed prompt and relevant image
+        return self.query_claude(*self._build_query(query))
+
+    def process_query_stream(self, query):
+        """Like process_query, but yields the answer as it is generated."""
+        return self.query_claude_stream(*self._build_query(query))
+
+    def _build_query(self, query):
         if not self.indexed_pdf:
             raise ValueError("No PDF has been indexed. Please upload and index a PDF first.")
 
         # Perform RAG search
-        results = self.rag_engine.search(query, k=3)
+        with self._lock, track_stage("image_rag", "rag_engine_search"):
+            results = self.rag_engine.search(query, k=3)
         if not results:
             raise ValueError("No results found from the RAG search.")
 
@@ -62,7 +77,7 @@ class RAGClaudeProcessor:
             raise AttributeError("Expected attribute 'page_num' not found in the first result.")
 
         image_index = getattr(results[0], "page_num", 1) - 1  # Default to first page if 'page_num' is missing
-        if image_index >= len(self.pdf_images) or image_index < 0:
+        if image_index >= documents.page_count(self.doc_id) or image_index < 0:
             raise IndexError("Invalid page number returned from RAG search.")
         
         full_prompt = f"""
@@ -81,10 +96,10 @@ class RAGClaudeProcessor:
         - Provide a concise but comprehensive explanation based solely on the provided content.
         """
 
-        # Query Claude with the constructed prompt and relevant image
-        return self.query_claude(full_prompt, self.pdf_images[image_index])
-    
-    def query_claude(self, prompt, image):
+        page_image = documents.page_image(self.doc_id, image_index, dpi=RENDER_DPI)
+        return full_prompt, page_image
+
+    def _claude_payload(self, prompt, image):
         # Convert image to base64
         buffered = BytesIO()
         image.save(buffered, format="PNG")
@@ -114,15 +129,70 @@ class RAGClaudeProcessor:
                 }
             ]
         }
+        return payload
+
+    def query_claude(self, prompt, image):
+        payload = self._claude_payload(prompt, image)
+        # Same query against the same page image was answered before
+        cache_key = make_key(MODEL_ID, {}, payload)
+        cached_answer = llm_cache.get("image_rag", cache_key)
+        if cached_answer is not None:
+            return cached_answer
+
         try:
             # Make the API call to AWS Bedrock
-            response = self.bedrock.invoke_model(
-                modelId='anthropic.claude-3-5-sonnet-20240620-v1:0',
-                body=json.dumps(payload)
+            reservation = budget.acquire(
+                "image_rag", estimate_tokens(prompt, images=1, max_output_tokens=payload["max_tokens"])
             )
-            # Parse and return the response
-            response_body = json.loads(response['body'].read())
-            return response_body['content'][0]['text']
+            try:
+                with scheduler.slot("image_rag", INTERACTIVE), track_request("image_rag", MODEL_ID) as call:
+                    response_body, usage = invoke_model(MODEL_ID, payload, call=call, client=self.bedrock)
+                input_tokens, output_tokens = usage or (0, 0)
+                usage_tracker.record(
+                    "image_rag", MODEL_ID, input_tokens, output_tokens,
+                    call.bytes_sent, call.bytes_received, reservation=reservation,
+                )
+            finally:
+                budget.release(reservation)
+            answer = response_body['content'][0]['text']
+            llm_cache.set("image_rag", cache_key, answer)
+            return answer
         except Exception as e:
             # Log or handle the error
             raise RuntimeError(f"Error while querying Claude: {e}")
+
+    def query_claude_stream(self, prompt, image):
+        """Yield Claude's answer in pieces as Bedrock streams it."""
+        payload = self._claude_payload(prompt, image)
+        cache_key = make_key(MODEL_ID, {}, payload)
+        cached_answer = llm_cache.get("image_rag", cache_key)
+        if cached_answer is not None:
+            yield cached_answer
+            return
+
+        try:
+            reservation = budget.acquire(
+                "image_rag", estimate_tokens(prompt, images=1, max_output_tokens=payload["max_tokens"])
+            )
+            try:
+                with scheduler.slot("image_rag", INTERACTIVE), track_request("image_rag", MODEL_ID) as call:
+                    stream = invoke_model_stream(MODEL_ID, payload, call=call)
+                    yield from stream
+                input_tokens, output_tokens = stream.usage or (0, 0)
+                usage_tracker.record(
+                    "image_rag", MODEL_ID, input_tokens, output_tokens,
+                    call.bytes_sent, call.bytes_received, reservation=reservation,
+                )
+            finally:
+                budget.release(reservation)
+            llm_cache.set("image_rag", cache_key, stream.text)
+        except Exception as e:
+            raise RuntimeError(f"Error while querying Claude: {e}")
+
+
+def index_pdf_job(job, processor, pdf_path):
+    # Job entry point (common.jobs); runs on a job thread because the loaded model stays in this process
+    job.progress(0, 1, message="Indexing PDF...")
+    processor.index_pdf(pdf_path)
+    job.progress(1, 1)
+    return pdf_path
@@ -0,0 +1,325 @@
+# run.py
+"""Headless benchmark harness for the five pipelines.
+
+Usage:
+    python -m benchmarks.run --scenarios brd resume etl --iterations 5 --pages 20
+    python -m benchmarks.run --compare benchmarks/results/old.json benchmarks/results/new.json
+"""
+import argparse
+import io
+import json
+import math
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+from benchmarks.synthetic import (
+    make_brd_pdf,
+    make_code_sample,
+    make_job_description,
+    make_resume_pdfs,
+    make_workflow_csv,
+)
+
+RESULTS_DIR = os.path.join("benchmarks", "results")
+
+
+# Each scenario does its setup once and returns (operation, units processed per operation)
+def brd_scenario(config):
+    import asyncio
+    from brd_master.analyze_pdf import analyze_pdf
+
+    pdf_bytes = make_brd_pdf(config["pages"])
+
+    def run():
+        results = asyncio.run(analyze_pdf(pdf_bytes))
+        failed = [page_num for page_num, result in results.items() if not result]
+        if failed:
+            raise RuntimeError(f"{len(failed)} pages failed")
+
+    return run, config["pages"]
+
+
+def code_switch_scenario(config):
+    from code_switch.functions import check_syntax, convert_code
+
+    code = make_code_sample()
+
+    def run():
+        converted = convert_code(code, "Python", "Java")
+        check_syntax(converted, "Java")
+
+    return run, 1
+
+
+def imagerag_scenario(config):
+    from ImageRAG.rag_claude import RAGClaudeProcessor
+
+    pdf_path = os.path.join(tempfile.mkdtemp(), "benchmark.pdf")
+    with open(pdf_path, "wb") as f:
+        f.write(make_brd_pdf(config["pages"]))
+    processor = RAGClaudeProcessor()
+
+    def run():
+        processor.indexed_pdf = None  # Force a fresh index every iteration
+        processor.index_pdf(pdf_path)
+        processor.process_query("Which requirements apply to payment approval?")
+
+    return run, config["pages"]
+
+
+def resume_scenario(config):
+    import numpy as np
+    from resume_mapping.embeddings import get_bedrock_client, get_titan_embedding
+    from resume_mapping.resume_analysis import sync_process_resumes
+    from resume_mapping.utils import create_faiss_index, parse_pdf_to_text
+
+    job_description = make_job_description()
+    uploaded_files = make_resume_pdfs(config["resumes"])
+
+    def run():
+        bedrock_client = get_bedrock_client()
+        job_embedding = get_titan_embedding(job_description, bedrock_client)
+        resumes = []
+        resume_embeddings = []
+        for uploaded_file in uploaded_files:
+            uploaded_file.seek(0)
+            resume_text = parse_pdf_to_text(uploaded_file)
+            resumes.append({"filename": uploaded_file.name, "resume_text": resume_text})
+            resume_embeddings.append(get_titan_embedding(resume_text, bedrock_client))
+        index = create_faiss_index(np.array(resume_embeddings, dtype="float32"))
+        distances, indices = index.search(np.array([job_embedding], dtype="float32"), len(resumes))
+        sync_process_resumes(job_description, resumes, distances, indices)
+
+    return run, config["resumes"]
+
+
+def etl_scenario(config):
+    import pandas as pd
+    from etl_job_rationalization.app import kmeans_clustering, perform_pca
+
+    csv_text = make_workflow_csv(config["rows"]).to_csv(index=False)
+
+    def run():
+        df = pd.read_csv(io.StringIO(csv_text))
+        features_pca = perform_pca(df)
+        kmeans_clustering(df, features_pca, config["clusters"])
+
+    return run, config["rows"]
+
+
+SCENARIOS = {
+    "brd": brd_scenario,
+    "code_switch": code_switch_scenario,
+    "imagerag": imagerag_scenario,
+    "resume": resume_scenario,
+    "etl": etl_scenario,
+}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return None
+    rank = max(0, min(len(values) - 1, math.ceil(pct / 100.0 * len(values)) - 1))
+    return values[rank]
+
+
+def reset_caches():
+    """Start the next iteration cold: no rendered pages, guardrail results or page analyses to reuse.
+
+    The document store moves to an empty directory and the in-process guardrail cache and
+    page deduplicator are cleared. Without this every iteration after the warmup would
+    only time cache hits. Modules a scenario does not use are not imported.
+    """
+    module = sys.modules.get("common.documents")
+    if module is not None:
+        previous = module.documents.cache_dir
+        module.documents.cache_dir = tempfile.mkdtemp(prefix="iteration-", dir=os.environ["DOCUMENT_CACHE_DIR"])
+        if os.path.dirname(previous) == os.environ["DOCUMENT_CACHE_DIR"]:
+            shutil.rmtree(previous, ignore_errors=True)
+    module = sys.modules.get("brd_master.analyze_image")
+    if module is not None:
+        module.guardrail_cache.clear()
+    module = sys.modules.get("brd_master.dedup")
+    if module is not None:
+        module.page_dedup.clear()
+
+
+def run_scenario(name, config):
+    """Run one scenario in the current process and return its measurements."""
+    try:
+        operation, units = SCENARIOS[name](config)
+        for _ in range(config["warmup"]):
+            reset_caches()
+            operation()
+    except Exception as e:
+        traceback.print_exc()
+        return {"error": f"setup failed: {e}"}
+
+    latencies = []
+    errors = 0
+    cpu_start = os.times()
+    wall_start = time.perf_counter()
+    for _ in range(config["iterations"]):
+        reset_caches()
+        start_time = time.perf_counter()
+        try:
+            operation()
+        except Exception as e:
+            errors += 1
+            print(f"[{name}] iteration failed: {e}", file=sys.stderr)
+        latencies.append(time.perf_counter() - start_time)
+    wall = time.perf_counter() - wall_start
+    cpu_end = os.times()
+
+    cpu_seconds = (cpu_end.user - cpu_start.user) + (cpu_end.system - cpu_start.system)
+    latencies.sort()
+    return {
+        "iterations": config["iterations"],
+        "errors": errors,
+        "units_per_iteration": units,
+        "latency_seconds": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "mean": sum(latencies) / len(latencies) if latencies else None,
+            "max": latencies[-1] if latencies else None,
+        },
+        "throughput": {
+            "iterations_per_second": config["iterations"] / wall if wall else None,
+            "units_per_second": config["iterations"] * units / wall if wall else None,
+        },
+        "cpu_percent": 100.0 * cpu_seconds / wall if wall else None,
+        # ru_maxrss is reported in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+    }
+
+
+def run_isolated(name, config):
+    """Run a scenario in a fresh interpreter so peak RSS is per scenario."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(run_scenario, name, config).result()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(base_path, head_path):
+    """Print the relative change of the headline numbers between two result files."""
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(head_path) as f:
+        head = json.load(f)
+
+    print(f"base {base['commit'][:10]}  ->  head {head['commit'][:10]}")
+    print(f"{'scenario':<12} {'metric':<22} {'base':>12} {'head':>12} {'change':>9}")
+    for name in sorted(set(base["scenarios"]) & set(head["scenarios"])):
+        base_result = base["scenarios"][name]
+        head_result = head["scenarios"][name]
+        if "error" in base_result or "error" in head_result:
+            print(f"{name:<12} skipped (error in one of the runs)")
+            continue
+        rows = [
+            ("p50 latency (s)", base_result["latency_seconds"]["p50"], head_result["latency_seconds"]["p50"]),
+            ("p95 latency (s)", base_result["latency_seconds"]["p95"], head_result["latency_seconds"]["p95"]),
+            ("p99 latency (s)", base_result["latency_seconds"]["p99"], head_result["latency_seconds"]["p99"]),
+            ("units/s", base_result["throughput"]["units_per_second"], head_result["throughput"]["units_per_second"]),
+            ("peak RSS (MB)", base_result["peak_rss_mb"], head_result["peak_rss_mb"]),
+            ("CPU (%)", base_result["cpu_percent"], head_result["cpu_percent"]),
+        ]
+        for metric, before, after in rows:
+            change = f"{100.0 * (after - before) / before:+.1f}%" if before else "n/a"
+            print(f"{name:<12} {metric:<22} {before:>12.4f} {after:>12.4f} {change:>9}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the GenAI pipelines without the Streamlit UI.")
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=["brd", "code_switch", "resume", "etl"])
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--pages", type=int, default=10, help="Pages per generated PDF")
+    parser.add_argument("--resumes", type=int, default=20, help="Resumes per batch")
+    parser.add_argument("--rows", type=int, default=5000, help="Rows per workflow CSV")
+    parser.add_argument("--clusters", type=int, default=4)
+    parser.add_argument("--backend", choices=["fake", "replay", "live"], default="fake",
+                        help="Value for BEDROCK_MODE in the benchmark processes")
+    parser.add_argument("--latency-ms", default="0", help="Injected model latency, e.g. 200 or 100-400")
+    parser.add_argument("--no-isolate", action="store_true", help="Run all scenarios in this process")
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/<commit>-<time>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "HEAD"), help="Diff two result files and exit")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    # Must be set before any app module is imported; spawned workers inherit it
+    os.environ["BEDROCK_MODE"] = args.backend
+    os.environ["BEDROCK_STANDIN_LATENCY_MS"] = args.latency_ms
+    os.environ["LLM_CACHE_ENABLED"] = "false"
+    os.environ["BRD_CHECKPOINT"] = "false"
+    # Each run, and each iteration within it (see reset_caches), starts with no rendered pages
+    os.environ["DOCUMENT_CACHE_DIR"] = tempfile.mkdtemp(prefix="benchmark-documents-")
+    os.environ.setdefault("GUARDRAIL_ID", "benchmark")
+    os.environ.setdefault("AWS_REGION", "us-east-1")
+
+    config = {
+        "iterations": args.iterations,
+        "warmup": args.warmup,
+        "pages": args.pages,
+        "resumes": args.resumes,
+        "rows": args.rows,
+        "clusters": args.clusters,
+    }
+    scenarios = {}
+    for name in args.scenarios:
+        print(f"Running {name}...", file=sys.stderr)
+        scenarios[name] = run_scenario(name, config) if args.no_isolate else run_isolated(name, config)
+    shutil.rmtree(os.environ["DOCUMENT_CACHE_DIR"], ignore_errors=True)
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "backend": args.backend,
+        "config": config,
+        "scenarios": scenarios,
+    }
+    output_path = args.output or os.path.join(
+        RESULTS_DIR, f"{commit[:10]}-{datetime.now().strftime('%Y%m%d%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for name, result in scenarios.items():
+        if "error" in result:
+            print(f"{name:<12} ERROR {result['error']}")
+            continue
+        latency = result["latency_seconds"]
+        print(
+            f"{name:<12} p50={latency['p50']:.3f}s p95={latency['p95']:.3f}s p99={latency['p99']:.3f}s "
+            f"{result['throughput']['units_per_second']:.1f} units/s "
+            f"rss={result['peak_rss_mb']:.0f}MB cpu={result['cpu_percent']:.0f}% errors={result['errors']}"
+        )
+    print(f"Results written to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# synthetic.py
+import io
+import random
+
+import fitz
+import pandas as pd
+
+WORDS = [
+    "the", "system", "shall", "allow", "user", "to", "submit", "request", "within",
+    "seconds", "validate", "account", "balance", "report", "admin", "approve", "payment",
+    "error", "message", "display", "field", "mandatory", "optional", "workflow", "status",
+]
+SKILLS = ["Python", "Java", "AWS", "SQL", "Spark", "Docker", "Kubernetes", "Airflow", "React", "COBOL"]
+
+
+def _paragraph(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def make_brd_pdf(pages, seed=0):
+    """Build an N-page BRD-like PDF with requirement text, a table grid and a shape per page."""
+    rng = random.Random(seed)
+    document = fitz.open()
+    for page_num in range(1, pages + 1):
+        page = document.new_page()
+        page.insert_text((72, 72), f"Section {page_num}: Business Requirements", fontsize=16)
+        y = 110
+        for rule in range(1, 6):
+            page.insert_textbox(
+                fitz.Rect(72, y, 540, y + 60),
+                f"BR-{page_num:03d}-{rule}: {_paragraph(rng, 30)}",
+                fontsize=10,
+            )
+            y += 70
+        for row in range(4):
+            for col in range(3):
+                page.draw_rect(fitz.Rect(72 + col * 156, y + row * 20, 228 + col * 156, y + row * 20 + 20))
+        page.draw_circle((450, 720), 30)
+    pdf_bytes = document.tobytes()
+    document.close()
+    return pdf_bytes
+
+
+def make_resume_pdfs(count, seed=0):
+    """Build M single-page resumes as in-memory files named like Streamlit uploads."""
+    rng = random.Random(seed)
+    resumes = []
+    for index in range(count):
+        document = fitz.open()
+        page = document.new_page()
+        skills = ", ".join(rng.sample(SKILLS, 4))
+        text = (
+            f"Candidate {index}\nSkills: {skills}\n"
+            f"Experience: {_paragraph(rng, 80)}\nEducation: {_paragraph(rng, 20)}"
+        )
+        page.insert_textbox(fitz.Rect(72, 72, 540, 770), text, fontsize=10)
+        resume = io.BytesIO(document.tobytes())
+        resume.name = f"resume_{index}.pdf"
+        document.close()
+        resumes.append(resume)
+    return resumes
+
+
+def make_job_description(seed=0):
+    rng = random.Random(seed)
+    return f"We are hiring an engineer with {', '.join(rng.sample(SKILLS, 5))}. {_paragraph(rng, 60)}"
+
+
+def make_workflow_csv(rows, seed=0):
+    """Build a K-row ETL workflow table shaped like data/csv/XmlToCsv.csv."""
+    rng = random.Random(seed)
+    data = {
+        "WorkflowName": [f"wf_{i}" for i in range(rows)],
+        "FlatFileSource_Format": [rng.choice(["Delimited", "FixedWidth", "Ragged"]) for _ in range(rows)],
+        "OleDbSource_Name": [rng.choice(["Customers", "Orders", "Payments", "Accounts"]) for _ in range(rows)],
+        "LookupTransform_Name": [rng.choice(["LkpCustomer", "LkpRegion", "LkpProduct"]) for _ in range(rows)],
+        "OleDbDestination_Name": [rng.choice(["DW_Sales", "DW_Finance", "DW_Ops"]) for _ in range(rows)],
+        "ColumnCount": [rng.randint(3, 60) for _ in range(rows)],
+        "TransformCount": [rng.randint(1, 12) for _ in range(rows)],
+    }
+    return pd.DataFrame(data).drop(columns=["WorkflowName"])
+
+
+def make_code_sample():
+    return (
+        "def add(a, b):\n"
+        "    return a + b\n\n"
+        "def main():\n"
+        "    import sys\n"
+        "    print(add(int(sys.argv[1]), int(sys.argv[2])))\n"
+    )
@@ -1,63 +1,263 @@
+import asyncio
 import base64
 import json
 import os
+import re
+import threading
 import time  # Added for timing
-from botocore.auth import SigV4Auth
-from botocore.awsrequest import AWSRequest
-from botocore.credentials import Credentials
+from functools import lru_cache
 from dotenv import load_dotenv
-import aiohttp
 import traceback  # For detailed error traceback
 
+from common.bedrock import get_region, signed_post, signed_post_stream
+from common.llm_cache import llm_cache, make_key
+from common.metrics import app_metrics, record_error, track_request
+from common.resilience import call_with_retry, get_limiter, is_retryable
+from common.scheduler import BULK, scheduler
+from common.tracing import span
+from common.usage import IMAGE_TOKENS, budget, estimate_tokens, usage_from_response, usage_tracker
+
 # Import Prometheus metrics
 
-from brd_master.metrics import metrics
+from brd_master.metrics import StageTimer, metrics
 
 # Load environment variables from .env file
 load_dotenv()
 
+PROMPT_PATH = "brd_master/prompt.txt"
+# per_document: evaluate the prompt template once (only the page number differs per page)
+# per_page: evaluate each formatted page prompt; identical inputs are still served from the cache
+GUARDRAIL_MODE = os.getenv("GUARDRAIL_MODE", "per_document").lower()
+GUARDRAIL_CACHE_TTL = int(os.getenv("GUARDRAIL_CACHE_TTL", "3600"))
+# Stands in for the base64 page image until the request body is serialised
+IMAGE_PLACEHOLDER = "__page_image__"
+# Precedes the prompt when a page is sent as its text layer instead of an image
+TEXT_PAGE_INTRO = "Page {page_num} of the PDF contains only text. Its extracted text follows.\n\n{page_text}"
+# Output tokens allowed per analyzed page
+MAX_TOKENS = 1000
+# Precedes each page image of a multi-page request
+IMAGE_PAGE_INTRO = "Page {page_num} of the PDF:"
+# Follows the prompt in a multi-page request, so the response can be split per page
+BATCH_INSTRUCTIONS = (
+    "\n\nThis message contains pages {page_nums} of the PDF. Apply the instructions above to each page "
+    "separately. Start the analysis of every page with a line containing only its delimiter, "
+    "for example:\n=== Page {first_page} ==="
+)
+PAGE_DELIMITER = re.compile(r"^[ \t]*=== Page (\d+) ===[ \t]*$", re.MULTILINE)
+
+
+@lru_cache(maxsize=1)
+def load_prompt_template():
+    with open(PROMPT_PATH, "r") as file:
+        return file.read()
+
+
+def normalize_guardrail_input(text):
+    return " ".join(text.split())
+
+
+def encode_request_body(request_body, *images):
+    """Serialise request_body to JSON bytes with the images base64-encoded in place of IMAGE_PLACEHOLDER.
+
+    Each occurrence of the placeholder, in order, takes the next image. The base64 text is
+    spliced into the serialised body rather than passed through json.dumps, which would
+    decode, scan and re-encode the largest part of the request.
+    """
+    segments = json.dumps(request_body).encode("utf-8").split(f'"{IMAGE_PLACEHOLDER}"'.encode("utf-8"))
+    parts = [segments[0]]
+    for image_data, segment in zip(images, segments[1:]):
+        parts.extend((b'"', base64.b64encode(image_data), b'"', segment))
+    return b"".join(parts)
+
+
+def split_pages(content, page_nums):
+    """Split a multi-page response at its page delimiters into {page_num: analysis}.
+
+    Returns None unless every page in page_nums has exactly one non-empty section.
+    """
+    if not content:
+        return None
+    matches = list(PAGE_DELIMITER.finditer(content))
+    if sorted(int(match.group(1)) for match in matches) != sorted(page_nums):
+        return None
+    results = {}
+    for match, following in zip(matches, matches[1:] + [None]):
+        section = content[match.end():following.start() if following else len(content)].strip()
+        if not section:
+            return None
+        results[int(match.group(1))] = section
+    return results
+
+
+class GuardrailCache:
+    """Guardrail results keyed on guardrail id and normalised input.
+
+    Concurrent checks of the same input on one event loop share a single request.
+    """
+
+    def __init__(self, ttl=GUARDRAIL_CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._results = {}
+        self._pending = {}
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+    async def check(self, session, guardrail_id, input_text):
+        key = (guardrail_id, normalize_guardrail_input(input_text))
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is not None and entry[0] > time.time():
+                app_metrics.cache_requests.labels("brd_master.guardrail", "hit").inc()
+                return entry[1]
+            pending = self._pending.get((loop, key))
+            owner = pending is None
+            if owner:
+                pending = self._pending[(loop, key)] = loop.create_future()
+        if not owner:
+            app_metrics.cache_requests.labels("brd_master.guardrail", "hit").inc()
+            return await asyncio.shield(pending)
+
+        app_metrics.cache_requests.labels("brd_master.guardrail", "miss").inc()
+        results = None
+        try:
+            results = await check_guardrails(session, guardrail_id, input_text)
+            if results is not None:
+                with self._lock:
+                    self._results[key] = (time.time() + self.ttl, results)
+            return results
+        finally:
+            with self._lock:
+                self._pending.pop((loop, key), None)
+            if not pending.done():
+                pending.set_result(results)
+
+
+# Create global guardrail cache instance
+guardrail_cache = GuardrailCache()
+
 
 async def check_guardrails(session, guardrail_id, input_text):
-    try:
-        aws_access_key_id = os.getenv("AWS_ACCESS_KEY_ID")
-        aws_secret_access_key = os.getenv("AWS_SECRET_ACCESS_KEY")
-        region = os.getenv("AWS_REGION")
+    with span("brd_master.check_guardrails", guardrail_id=guardrail_id):
+        return await _check_guardrails(session, guardrail_id, input_text)
 
-        credentials = Credentials(
-            access_key=aws_access_key_id, secret_key=aws_secret_access_key
-        )
 
+async def _check_guardrails(session, guardrail_id, input_text):
+    try:
+        region = get_region()
         url = f"https://bedrock.{region}.amazonaws.com/agents/guardrails/{guardrail_id}/evaluations"
-        headers = {
-            "Content-Type": "application/json",
-            "Accept": "application/json",
-        }
         request_body = {"inputText": input_text}
 
-        request = AWSRequest(
-            method="POST", url=url, data=json.dumps(request_body), headers=headers
-        )
-        SigV4Auth(credentials, "bedrock", region).add_auth(request)
+        async def attempt():
+            async with scheduler.slot_async("brd_master", BULK):
+                with track_request("brd_master", "guardrail") as call, StageTimer("guardrail", "guardrail"):
+                    return await signed_post(session, url, request_body, call=call)
 
-        async with session.post(
-            url, data=request.body, headers=dict(request.headers)
-        ) as response:
-            response_body = await response.json()
-            return response_body.get("results", [])
+        response_body = await call_with_retry("brd_master", attempt, get_limiter("brd_master.guardrail"))
+        return response_body.get("results", [])
 
     except Exception as e:
         print(f"An error occurred while checking guardrails: {e}")
         return None
 
 
-async def analyze_image(session, model_id, image_data, page_num):
+def _image_part(media_type):
+    return {
+        "type": "image",
+        "source": {
+            "type": "base64",
+            "media_type": media_type,
+            "data": IMAGE_PLACEHOLDER,
+        },
+    }
+
+
+async def analyze_image(session, model_id, image_data, page_num, on_text=None, media_type="image/png",
+                        image_tokens=IMAGE_TOKENS):
+    """Analyze one page image; with on_text(page_num, delta) the response is streamed."""
+    with span("brd_master.analyze_page", page=page_num, mode="image", media_type=media_type,
+              image_bytes=len(image_data)):
+        page_part = _image_part(media_type)
+        return page_num, await _analyze_page(
+            session, model_id, page_num, [page_part], on_text, (image_data,), image_tokens
+        )
+
+
+async def analyze_text(session, model_id, page_text, page_num, on_text=None):
+    """Analyze a page from its text layer (no vision input); otherwise like analyze_image."""
+    with span("brd_master.analyze_page", page=page_num, mode="text", text_chars=len(page_text)):
+        page_part = {"type": "text", "text": TEXT_PAGE_INTRO.format(page_num=page_num, page_text=page_text)}
+        return page_num, await _analyze_page(session, model_id, page_num, [page_part], on_text)
+
+
+async def analyze_pages(session, model_id, pages):
+    """Analyze several pages in a single request and return {page_num: result}.
+
+    pages is a list of dicts with "page_num" and either "text" or "image", "media_type"
+    and "image_tokens". The prompt is sent once, with instructions to start each page's
+    analysis with a delimiter; None is returned when the request fails or the response
+    cannot be split into one analysis per page. The response is not streamed.
+    """
+    page_nums = [page["page_num"] for page in pages]
+    with span("brd_master.analyze_pages", pages=len(pages)):
+        page_parts = []
+        images = []
+        for page in pages:
+            if "text" in page:
+                page_parts.append(
+                    {"type": "text", "text": TEXT_PAGE_INTRO.format(page_num=page["page_num"], page_text=page["text"])}
+                )
+            else:
+                page_parts.append({"type": "text", "text": IMAGE_PAGE_INTRO.format(page_num=page["page_num"])})
+                page_parts.append(_image_part(page["media_type"]))
+                images.append(page["image"])
+        label = ", ".join(str(page_num) for page_num in page_nums)
+        content = await _analyze_page(
+            session, model_id, label, page_parts, images=tuple(images),
+            image_tokens=sum(page.get("image_tokens", 0) for page in pages),
+            instructions=BATCH_INSTRUCTIONS.format(page_nums=label, first_page=page_nums[0]),
+            page_count=len(pages),
+        )
+        return split_pages(content, page_nums)
+
+
+async def _analyze_page(session, model_id, page_num, page_parts, on_text=None, images=(),
+                        image_tokens=IMAGE_TOKENS, instructions="", page_count=1):
+    """Send page_parts with the prompt for page_num and return the model's text.
+
+    page_num is a page number, or a label listing the pages of a multi-page request.
+    images fill the IMAGE_PLACEHOLDER parts in order and image_tokens is their estimated
+    total. Failures are returned as None or as a short error message.
+    """
     start_time = time.time()  # Start timing the analysis duration
     try:
-        encoded_image = base64.b64encode(image_data).decode("utf-8")
+        prompt = load_prompt_template().format(page_num=page_num) + instructions
+
+        request_body = {
+            "anthropic_version": "bedrock-2023-05-31",
+            "max_tokens": MAX_TOKENS * page_count,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": page_parts + [{"type": "text", "text": prompt}],
+                }
+            ],
+        }
+        with StageTimer("encode", model_id):
+            if not images:
+                body = json.dumps(request_body).encode("utf-8")
+            else:
+                body = encode_request_body(request_body, *images)
 
-        # Read the prompt from the file
-        with open("brd_master/prompt.txt", "r") as file:
-            prompt = file.read().format(page_num=page_num)
+        # Identical page + prompt + model was analyzed before: skip guardrails and the model call
+        cache_key = make_key(model_id, {}, body)
+        cached_content = llm_cache.get("brd_master", cache_key)
+        if cached_content is not None:
+            metrics.analyzed_pages.inc(page_count)  # Increment analyzed pages counter
+            return cached_content
 
         # Get the Guardrail ID from environment variables
         guardrail_id = os.getenv("GUARDRAIL_ID")
@@ -65,74 +265,98 @@ async def analyze_image(session, model_id, image_data, page_num):
             raise ValueError("Guardrail ID is not set in environment variables.")
 
         # Check guardrails
-        guardrail_results = await check_guardrails(session, guardrail_id, prompt)
+        guardrail_input = load_prompt_template() if GUARDRAIL_MODE == "per_document" else prompt
+        guardrail_results = await guardrail_cache.check(session, guardrail_id, guardrail_input)
         if guardrail_results is None:
             metrics.analysis_errors.inc()  # Increment error counter
-            return page_num, "Error checking guardrails"
+            return "Error checking guardrails"
 
         # If guardrails failed, return without invoking the model
         if any(result.get("evaluation") == "FAIL" for result in guardrail_results):
             metrics.analysis_errors.inc()  # Increment error counter
-            return page_num, "Content blocked by guardrails"
-
-        request_body = {
-            "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": 1000,
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": "image/png",
-                                "data": encoded_image,
-                            },
-                        },
-                        {"type": "text", "text": prompt},
-                    ],
-                }
-            ],
-        }
-
-        aws_access_key_id = os.getenv("AWS_ACCESS_KEY_ID")
-        aws_secret_access_key = os.getenv("AWS_SECRET_ACCESS_KEY")
-        region = os.getenv("AWS_REGION")
-
-        credentials = Credentials(
-            access_key=aws_access_key_id, secret_key=aws_secret_access_key
-        )
+            record_error("brd_master", "guardrail_blocked")
+            return "Content blocked by guardrails"
 
+        region = get_region()
         url = f"https://bedrock-runtime.{region}.amazonaws.com/model/{model_id}/invoke"
-        headers = {
-            "Content-Type": "application/json",
-            "Accept": "application/json",
-        }
-        request = AWSRequest(
-            method="POST", url=url, data=json.dumps(request_body), headers=headers
+        reservation = await budget.acquire_async(
+            "brd_master",
+            estimate_tokens(
+                prompt + "".join(part.get("text", "") for part in page_parts),
+                max_output_tokens=request_body["max_tokens"],
+            ) + (image_tokens if images else 0),
         )
-        SigV4Auth(credentials, "bedrock", region).add_auth(request)
+        streamed = False
+        attempts = 0
+        call = None
+
+        async def attempt():
+            nonlocal streamed, attempts, call
+            attempts += 1
+            async with scheduler.slot_async("brd_master", BULK):
+                with track_request("brd_master", model_id) as call:
+                    start_time = time.perf_counter()
+                    outcome = "error"
+                    try:
+                        if on_text is None:
+                            response_body = await signed_post(session, url, body, call=call)
+                        else:
+                            stream = signed_post_stream(session, f"{url}-with-response-stream", body, call=call)
+                            async for delta in stream:
+                                streamed = True
+                                on_text(page_num, delta)
+                            input_tokens, output_tokens = stream.usage or (0, 0)
+                            response_body = {
+                                "content": [{"type": "text", "text": stream.text}],
+                                "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens},
+                            }
+                        outcome = "ok"
+                        return response_body
+                    finally:
+                        # Response decoding is reported as the parse stage, not as Bedrock time
+                        seconds = time.perf_counter() - start_time - call.parse_seconds
+                        StageTimer("model", model_id).observe(seconds, outcome)
 
-        async with session.post(
-            url, data=request.body, headers=dict(request.headers)
-        ) as response:
-            response_body = await response.json()
+        # A stream that already delivered text is not retried, or the page would repeat itself
+        outcome = "error"
+        try:
+            response_body = await call_with_retry(
+                "brd_master", attempt, get_limiter("brd_master.model"),
+                should_retry=lambda e: not streamed and is_retryable(e),
+            )
+            parse_start = time.perf_counter()
+            input_tokens, output_tokens = usage_from_response(body=response_body) or (0, 0)
             content = response_body.get("content", [{}])[0].get("text", "No content")
+            StageTimer("parse", model_id).observe(time.perf_counter() - parse_start + call.parse_seconds)
+            outcome = "ok" if content and content != "No content" else "empty"
+            usage_tracker.record(
+                "brd_master", model_id, input_tokens, output_tokens, call.bytes_sent, call.bytes_received,
+                reservation=reservation,
+            )
+        finally:
+            # Settled above on success; a failed call gives its estimate back
+            budget.release(reservation)
+            metrics.request_bytes.labels(model_id, outcome).observe(len(body))
+            if call is not None:
+                metrics.response_bytes.labels(model_id, outcome).observe(call.bytes_received)
+            metrics.page_retries.labels(model_id, outcome).observe(max(attempts - 1, 0))
 
-            if not content or content == "No content":
-                print(
-                    f"Page {page_num} - Full Response: {json.dumps(response_body, indent=2)}"
-                )
+        if outcome == "empty":
+            print(
+                f"Page {page_num} - Full Response: {json.dumps(response_body, indent=2)}"
+            )
+            record_error("brd_master", "empty_response")
+        else:
+            llm_cache.set("brd_master", cache_key, content)
 
-            metrics.analyzed_pages.inc()  # Increment analyzed pages counter
-            return page_num, content
+        metrics.analyzed_pages.inc(page_count)  # Increment analyzed pages counter
+        return content
 
     except Exception as e:
         print(f"An error occurred while processing page {page_num}: {e}")
         traceback.print_exc()
         metrics.analysis_errors.inc()  # Increment error counter
-        return page_num, None
+        return None
 
     finally:
         duration = time.time() - start_time
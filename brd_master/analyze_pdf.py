@@ -1,24 +1,340 @@
-import fitz
 import asyncio
-import aiohttp
-from brd_master.analyze_image import analyze_image
-from brd_master.metrics import metrics, AsyncTimer
+import contextlib
+import contextvars
+import functools
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from common.bedrock import create_http_session
+from common.documents import documents, render_page_to_cache
+from brd_master.analyze_image import TEXT_PAGE_INTRO, analyze_image, analyze_text, load_prompt_template
+from brd_master.batching import BATCH_SIZE, PageBatch, fits
+from brd_master.checkpoint import checkpoint, prompt_version
+from brd_master.dedup import DEDUP_ENABLED, page_dedup
+from brd_master.page_images import IMAGE, TEXT, page_encoding, page_mode
+from brd_master.remove_pages import select_pages
+from brd_master.metrics import metrics, AsyncTimer, StageTimer
+from common.metrics import app_metrics, track_stage
+from common.tracing import span, traced
 
-async def analyze_pdf(pdf_bytes):
-    model_id = "anthropic.claude-3-5-sonnet-20240620-v1:0"
-    pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
+MODEL_ID = "anthropic.claude-3-5-sonnet-20240620-v1:0"
+
+# Streamed text is forwarded from the job worker at most this often
+STREAM_FLUSH_SECONDS = 0.5
+# Page rendering runs in a "thread" or "process" pool of BRD_RENDER_WORKERS. In thread
+# mode every MuPDF call holds the document service lock, so renders do not run in
+# parallel and more than one worker only overlaps them with other preparation steps;
+# use process mode to rasterise several pages at once.
+RENDER_EXECUTOR = os.getenv("BRD_RENDER_EXECUTOR", "thread").lower()
+RENDER_WORKERS = int(os.getenv("BRD_RENDER_WORKERS", "2"))
+# Rendered pages waiting for a free analysis worker
+QUEUE_DEPTH = int(os.getenv("BRD_QUEUE_DEPTH", "4"))
+# Pages analyzed concurrently (further bounded by the adaptive limiter and scheduler)
+ANALYSIS_WORKERS = int(os.getenv("BRD_ANALYSIS_WORKERS", "16"))
+
+def create_render_pool():
+    """Return a new page render pool; whoever creates it shuts it down."""
+    if RENDER_EXECUTOR == "process":
+        return ProcessPoolExecutor(max_workers=RENDER_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix="brd-render")
+
+
+def _text_page(doc_id, page_index):
+    """Return the page's analysis input if it takes the text path, else None."""
+    if page_mode(doc_id, page_index) != TEXT:
+        return None
+    with track_stage("brd_master", "extract_text", page=page_index + 1):
+        return {"mode": TEXT, "text": documents.page_text(doc_id, page_index)}
+
+
+def _image_page(doc_id, page_index):
+    with track_stage("brd_master", "render_page", page=page_index + 1), StageTimer("render", MODEL_ID):
+        render_kwargs, media_type, tokens = page_encoding(doc_id, page_index)
+        image = documents.render_page(doc_id, page_index, **render_kwargs)
+    return {"mode": IMAGE, "image": image, "media_type": media_type, "image_tokens": tokens}
+
+
+def _fingerprint(page, doc_id, page_index):
+    page["fingerprint"] = None
+    if DEDUP_ENABLED:
+        with track_stage("brd_master", "fingerprint", page=page_index + 1):
+            page["fingerprint"] = documents.page_fingerprint(doc_id, page_index)
+    return page
+
+
+def _prepare_in_thread(doc_id, page_index):
+    page = _text_page(doc_id, page_index) or _image_page(doc_id, page_index)
+    return _fingerprint(page, doc_id, page_index)
+
+
+async def _prepare(loop, executor, doc_id, page_index):
+    """Return a page's analysis input.
+
+    Either {"mode": "text", "text"} or {"mode": "image", "image", "media_type", "image_tokens"},
+    plus its "fingerprint" (None with deduplication off).
+    """
+    # Copy the context so the stage spans nest under the current trace
+    context = contextvars.copy_context()
+    if RENDER_EXECUTOR != "process":
+        return await loop.run_in_executor(executor, context.run, _prepare_in_thread, doc_id, page_index)
+    # Classification and text extraction are cheap; only rasterisation goes to the process pool.
+    # The rest takes the document service lock, so it runs on the default pool, not the loop.
+    page = await loop.run_in_executor(None, context.run, _text_page, doc_id, page_index)
+    if page is None:
+        render_kwargs, media_type, tokens = await loop.run_in_executor(None, page_encoding, doc_id, page_index)
+        seconds = await loop.run_in_executor(
+            executor,
+            functools.partial(render_page_to_cache, documents.cache_dir, doc_id, page_index, **render_kwargs),
+        )
+        app_metrics.stage_latency.labels("brd_master", "render_page").observe(seconds)
+        StageTimer("render", MODEL_ID).observe(seconds)
+        image = await loop.run_in_executor(
+            None, functools.partial(documents.render_page, doc_id, page_index, **render_kwargs)
+        )
+        page = {"mode": IMAGE, "image": image, "media_type": media_type, "image_tokens": tokens}
+    return await loop.run_in_executor(None, context.run, _fingerprint, page, doc_id, page_index)
+
+
+async def _analyze_page(session, page_num, page, on_text=None, page_slots=None):
+    async with page_slots or contextlib.nullcontext():
+        if page["mode"] == TEXT:
+            return (await analyze_text(session, MODEL_ID, page["text"], page_num, on_text))[1]
+        return (await analyze_image(
+            session, MODEL_ID, page["image"], page_num, on_text,
+            media_type=page["media_type"], image_tokens=page["image_tokens"],
+        ))[1]
+
+
+async def _next_result(results, workers):
+    """Return the next item of results, raising instead if a worker task fails first."""
+    getter = asyncio.ensure_future(results.get())
+    try:
+        while True:
+            running = []
+            for worker in workers:
+                if not worker.done():
+                    running.append(worker)
+                elif worker.cancelled():
+                    raise RuntimeError("A page analysis worker was cancelled")
+                elif worker.exception() is not None:
+                    raise worker.exception()
+            if running:
+                done, _ = await asyncio.wait([getter, *running], return_when=asyncio.FIRST_COMPLETED)
+                if getter in done:
+                    return getter.result()
+            else:
+                # Every worker finished, so nothing can still be added to results
+                await asyncio.sleep(0)
+                if not getter.done():
+                    raise RuntimeError("Page analysis stopped before every page was reported")
+                return getter.result()
+    finally:
+        getter.cancel()
+
+
+async def _analyze_pages(doc_id, page_indices, on_text=None, session=None, page_slots=None, render_pool=None):
+    """Prepare the given pages in a pool into a bounded queue that feeds ANALYSIS_WORKERS consumers.
+
+    At most RENDER_WORKERS pages are being prepared, QUEUE_DEPTH batches are waiting and
+    ANALYSIS_WORKERS are being analyzed, so memory does not grow with the page count.
+    With BRD_BATCH_PAGES above 1, consecutive pages are queued in batches that fit the
+    brd_master.batching limits and each batch is analyzed in one request (not streamed).
+    Yields (page_num, result, details) with page_num the page's number in the whole document;
+    details has the page's "mode" ("text" or "image",
+    None if preparation failed) and "duplicate_of", the page whose analysis was reused, with
+    "duplicate_document", that page's document id, when it belongs to another document.
+    session, page_slots (an asyncio.Semaphore bounding pages under analysis) and
+    render_pool (from create_render_pool()) can be shared by several documents processed
+    together; without render_pool the run creates its own and shuts it down when it ends.
+    """
     metrics.processed_pdfs.inc()
+    loop = asyncio.get_running_loop()
+    total = len(page_indices)
+    pages = asyncio.Queue(maxsize=QUEUE_DEPTH)
+    results = asyncio.Queue()
 
     async with AsyncTimer(metrics.request_time):
-        async with aiohttp.ClientSession() as session:
-            tasks = []
-            for page_num in range(len(pdf_document)):
-                page = pdf_document.load_page(page_num)
-                pix = page.get_pixmap()
-                img_data = pix.tobytes("png")
-                tasks.append(analyze_image(session, model_id, img_data, page_num + 1))
-
-            results = await asyncio.gather(*tasks)
-
-    pdf_document.close()
-    return dict(results)
\ No newline at end of file
+        async with contextlib.nullcontext(session) if session else create_http_session() as session:
+
+            async def produce():
+                rendering = deque()
+                batch = []
+
+                async def flush():
+                    if batch:
+                        await pages.put(list(batch))
+                        batch.clear()
+
+                async def hand_over():
+                    page_index, render = rendering.popleft()
+                    try:
+                        page = await render
+                    except Exception as e:
+                        print(f"An error occurred while rendering page {page_index + 1}: {e}")
+                        metrics.analysis_errors.inc()
+                        await results.put((page_index + 1, None, {"mode": None, "duplicate_of": None}))
+                        return
+                    if not fits(batch, page):
+                        await flush()
+                    batch.append((page_index, page))
+                    if len(batch) >= BATCH_SIZE:
+                        await flush()
+
+                try:
+                    for page_index in page_indices:
+                        rendering.append((page_index, asyncio.ensure_future(_prepare(loop, executor, doc_id, page_index))))
+                        if len(rendering) >= RENDER_WORKERS:
+                            await hand_over()
+                    while rendering:
+                        await hand_over()
+                    await flush()
+                finally:
+                    for _, render in rendering:
+                        render.cancel()
+                for _ in range(ANALYSIS_WORKERS):
+                    await pages.put(None)
+
+            async def consume():
+                while True:
+                    item = await pages.get()
+                    if item is None:
+                        return
+                    if len(item) > 1:
+                        batch = PageBatch(
+                            session, MODEL_ID,
+                            functools.partial(_analyze_page, session, on_text=on_text, page_slots=page_slots),
+                            page_slots,
+                        )
+                    else:
+                        batch = None
+                    await asyncio.gather(*(finish(page_index, page, batch) for page_index, page in item))
+
+            async def finish(page_index, page, batch):
+                async def analyze():
+                    metrics.page_modes.labels(page["mode"]).inc()
+                    if batch is not None:
+                        return await batch.analyze(page_index + 1, page)
+                    return await _analyze_page(session, page_index + 1, page, on_text, page_slots)
+
+                # Matches pages of any document analyzed in this process, not only this one
+                result, original = await page_dedup.run(doc_id, page_index + 1, page["fingerprint"], analyze)
+                details = {"mode": page["mode"], "duplicate_of": None}
+                if original is not None:
+                    metrics.deduplicated_pages.inc()
+                    original_doc, details["duplicate_of"] = original
+                    if original_doc != doc_id:
+                        details["duplicate_document"] = original_doc
+                await results.put((page_index + 1, result, details))
+
+            executor = render_pool or create_render_pool()
+            workers = [asyncio.create_task(produce())]
+            workers.extend(asyncio.create_task(consume()) for _ in range(ANALYSIS_WORKERS))
+            try:
+                for _ in range(total):
+                    yield await _next_result(results, workers)
+            finally:
+                # The consumer stopped early (cancelled job, closed page): drop the remaining pages
+                for worker in workers:
+                    worker.cancel()
+                if render_pool is None:
+                    # Renders still running finish in the background; queued ones are dropped
+                    executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def _resume_pages(doc_id, page_indices, on_text=None, session=None, page_slots=None, render_pool=None):
+    """Yield pages finished by an earlier run from the checkpoint, then analyze the rest.
+
+    Resumed pages have "resumed": True in their details; new results are checkpointed
+    as they complete.
+    """
+    version = prompt_version(load_prompt_template(), TEXT_PAGE_INTRO)
+    finished = checkpoint.load(doc_id, version, MODEL_ID)
+    remaining = []
+    for page_index in page_indices:
+        if page_index + 1 in finished:
+            result, details = finished[page_index + 1]
+            yield page_index + 1, result, {**details, "resumed": True}
+        else:
+            remaining.append(page_index)
+    if not remaining:
+        return
+    async for page_num, result, details in _analyze_pages(
+        doc_id, remaining, on_text, session, page_slots, render_pool
+    ):
+        checkpoint.save(doc_id, version, MODEL_ID, page_num, result, details)
+        yield page_num, result, details
+
+
+async def analyze_pdf_iter(pdf_bytes, on_text=None, start_page=1, end_page=None, pages=None, session=None,
+                          page_slots=None, render_pool=None):
+    """Yield (page_num, result, details) for each page as soon as it is analyzed, in completion order.
+
+    Only pages start_page..end_page (1-based, inclusive), or the page numbers listed in
+    pages, are analyzed; results keep their page numbers in the uploaded document.
+    details records whether the page was sent as "text" or as an "image" ("mode") and, for
+    a duplicate page, the page whose analysis it reuses ("duplicate_of", with
+    "duplicate_document" when that page is in another document). Pages already
+    analyzed by an earlier run of the same document, prompt and model come first, from
+    the checkpoint, with "resumed": True. With on_text(page_num, delta) page responses are
+    streamed as they are generated. Callers analyzing several documents at once can share
+    an HTTP session, a page_slots semaphore that bounds pages under analysis overall and a
+    render_pool from create_render_pool().
+    """
+    doc_id = documents.register(pdf_bytes)
+    page_indices = select_pages(documents.page_count(doc_id), start_page, end_page, pages)
+    with span("brd_master.analyze_pdf", pages=len(page_indices)):
+        async for page_num, result, details in _resume_pages(
+            doc_id, page_indices, on_text, session, page_slots, render_pool
+        ):
+            yield page_num, result, details
+
+
+@traced("brd_master.analyze_pdf")
+async def analyze_pdf(pdf_bytes, progress=None, on_text=None, start_page=1, end_page=None, pages=None):
+    """Analyze the selected pages and return {page_num: result} in page order.
+
+    Pages are selected and resumed as in analyze_pdf_iter(). progress(done, total,
+    page_num, result, details) is called as pages finish, with details as in
+    analyze_pdf_iter().
+    """
+    doc_id = documents.register(pdf_bytes)
+    page_indices = select_pages(documents.page_count(doc_id), start_page, end_page, pages)
+    results = {}
+    async for page_num, result, details in _resume_pages(doc_id, page_indices, on_text):
+        results[page_num] = result
+        if progress is not None:
+            progress(len(results), len(page_indices), page_num, result, details)
+    return dict(sorted(results.items()))
+
+
+def analyze_pdf_job(job, pdf_bytes, start_page=1, end_page=None, pages=None):
+    """Job entry point (common.jobs): rasterise and analyze a PDF in a worker process.
+
+    Pages are selected, and resumed from the checkpoint, as in analyze_pdf_iter(). Partials
+    are {"page", "delta"} pieces of streamed text, batched per page, and {"page", "result",
+    "mode", "duplicate_of"} (plus "duplicate_document" for a copy of another document's page
+    and "resumed" for checkpointed pages) once a page is finished.
+    """
+    pending = {}
+    last_flush = [time.monotonic()]
+
+    def flush():
+        for page_num, parts in pending.items():
+            job.progress(None, partial={"page": page_num, "delta": "".join(parts)})
+        pending.clear()
+        last_flush[0] = time.monotonic()
+
+    def stream_text(page_num, delta):
+        pending.setdefault(page_num, []).append(delta)
+        if time.monotonic() - last_flush[0] >= STREAM_FLUSH_SECONDS:
+            flush()
+
+    def report(done, total, page_num, result, details):
+        pending.pop(page_num, None)
+        job.progress(done, total, message="Analyzing pages", partial={"page": page_num, "result": result, **details})
+
+    return asyncio.run(analyze_pdf(
+        pdf_bytes, progress=report, on_text=stream_text, start_page=start_page, end_page=end_page, pages=pages
+    ))
\ No newline at end of file
@@ -1,10 +1,8 @@
 import streamlit as st
-import asyncio
-import tempfile
-import os
-from prometheus_client import start_http_server
-from brd_master.analyze_pdf import analyze_pdf
-from brd_master.remove_pages import remove_preceding_pages
+from common.metrics import start_exporter
+from common.jobs import get_job_manager, poll_job
+from brd_master.analyze_pdf import analyze_pdf_job
+from brd_master.report import page_details, page_note, results_text
 
 def run():
     # Center the title and make it bigger using HTML and CSS
@@ -54,63 +52,80 @@ Simply upload your file below to get started!
             "Start analyzing from page:", min_value=1, value=1, step=1
         )
         
-        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-            temp_file.write(uploaded_file.read())
-            temp_file_path = temp_file.name
-        
         if st.button("Analyze PDF"):
-            status_placeholder = st.empty()
-            status_placeholder.write("Analyzing the PDF...")
-            
-            temp_output_path = temp_file_path + "_modified.pdf"
-            
-            result_text = ""
-            
             try:
-                # Remove preceding pages
-                remove_preceding_pages(temp_file_path, start_page, temp_output_path)
-                
-                with open(temp_output_path, "rb") as f:
-                    pdf_bytes = f.read()
-                
-                results = asyncio.run(analyze_pdf(pdf_bytes))
-                
-                # Prepare results for download
-                for page_num, result in results.items():
-                    result_text += f"Page {page_num}:\n"
-                    if result:
-                        result_text += f"{result}\n\n"
-                    else:
-                        result_text += "Failed to analyze this page.\n\n"
-                
-                # Display download button before showing results
-                st.download_button(
-                    label="Download Results as .txt",
-                    data=result_text,
-                    file_name="analysis_results.txt",
-                    mime="text/plain",
+                # The upload goes to the job as bytes; pages before start_page are skipped there,
+                # and an invalid start page is reported as a failed job
+                st.session_state["brd_job"] = get_job_manager().submit(
+                    analyze_pdf_job, uploaded_file.getvalue(), start_page=int(start_page), label="BRD analysis"
                 )
-                
-                # Clear the "Analyzing the PDF..." message
-                status_placeholder.empty()
-                
-                # Display the results as they come, after showing download option
-                for page_num, result in results.items():
-                    st.write(f"\nAnalysis result for Page {page_num}:")
-                    if result:
-                        st.write(result)
-                    else:
-                        st.write("Failed to analyze this page.")
-            
+                st.session_state["brd_results"] = None
+                st.session_state["brd_details"] = {}
             except Exception as e:
-                status_placeholder.write(f"An error occurred: {e}")
-            finally:
-                temp_file.close()
-                os.remove(temp_file_path)
-                if os.path.exists(temp_output_path):
-                    os.remove(temp_output_path)
+                st.write(f"An error occurred: {e}")
+
+    job_id = st.session_state.get("brd_job")
+    if job_id:
+        status = poll_job(job_id, label="Analyzing the PDF...", on_progress=show_partial_results)
+        if status["status"] == "done":
+            st.session_state["brd_results"] = get_job_manager().result(job_id)
+            st.session_state["brd_details"] = page_details(status["partials"])
+        elif status["status"] == "failed":
+            st.write(f"An error occurred: {status['error']}")
+            st.write("Pages finished so far are saved; analyze the same file again to resume.")
+        elif status["status"] == "cancelled":
+            st.write("Analysis cancelled. Analyze the same file again to resume from the finished pages.")
+        get_job_manager().forget(job_id)
+        st.session_state["brd_job"] = None
+
+    results = st.session_state.get("brd_results")
+    if results:
+        # Display download button before showing results
+        st.download_button(
+            label="Download Results as .txt",
+            data=results_text(results, st.session_state.get("brd_details", {})),
+            file_name="analysis_results.txt",
+            mime="text/plain",
+        )
+        
+        # Display the results after showing download option
+        details = st.session_state.get("brd_details", {})
+        resumed = sum(1 for page in details.values() if page.get("resumed"))
+        if resumed:
+            st.info(f"{resumed} of {len(results)} pages were restored from an earlier run of this file.")
+        for page_num, result in results.items():
+            st.write(f"\nAnalysis result for Page {page_num}{page_note(details.get(page_num))}:")
+            if result:
+                st.write(result)
+            else:
+                st.write("Failed to analyze this page.")
+
+def show_partial_results(status):
+    # Finished pages and text streamed so far for pages still in progress
+    finished = {}
+    streaming = {}
+    for partial in status["partials"]:
+        if "result" in partial:
+            finished[partial["page"]] = partial["result"]
+            streaming.pop(partial["page"], None)
+        else:
+            streaming[partial["page"]] = streaming.get(partial["page"], "") + partial["delta"]
+
+    if finished:
+        st.download_button(
+            label=f"Download {len(finished)} finished pages as .txt",
+            data=results_text(dict(sorted(finished.items())), page_details(status["partials"])),
+            file_name="analysis_results_partial.txt",
+            mime="text/plain",
+            key=f"partial_download_{len(finished)}",
+        )
+    pages = {**{n: r or "Failed to analyze this page." for n, r in finished.items()}, **streaming}
+    details = page_details(status["partials"])
+    for page_num, text in sorted(pages.items()):
+        st.write(f"\nAnalysis result for Page {page_num}{page_note(details.get(page_num))}:")
+        st.write(text)
 
 if __name__ == "__main__":
     # Start Prometheus metrics server
-    # start_http_server(8000)  # Exposes metrics on http://localhost:8000/metrics
+    start_exporter()  # Exposes metrics on http://localhost:8000/metrics
     run()
@@ -0,0 +1,184 @@
+"""Headless BRD Test Master over many documents.
+
+Usage:
+    python -m brd_master.batch requirements/ --output reports/
+    python -m brd_master.batch manifest.jsonl --documents 4 --concurrency 16
+
+Inputs are PDF files, directories (searched recursively for PDFs) or manifests: a .txt
+file with one path per line, or a .jsonl file of {"path", "start_page", "end_page",
+"pages"} objects. Relative manifest paths are resolved against the manifest's directory.
+Each document gets a .txt report and a .json file of page results in the output
+directory, plus a summary.json for the whole run. Finished pages are checkpointed, so
+re-running the same command after an interruption only analyzes what is missing.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+from brd_master.analyze_pdf import ANALYSIS_WORKERS, analyze_pdf_iter, create_render_pool
+from brd_master.checkpoint import FAILED_RESULTS
+from brd_master.report import results_text
+from common.bedrock import create_http_session
+
+
+def _pdfs_in(directory):
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(".pdf"):
+                path = os.path.join(root, name)
+                yield path, os.path.relpath(path, directory)
+
+
+def _read_manifest(manifest_path):
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            entry = json.loads(line) if manifest_path.endswith(".jsonl") else {"path": line}
+            entry["path"] = os.path.join(base, entry["path"])
+            yield entry
+
+
+def load_documents(inputs):
+    """Expand the command-line inputs into document entries with a unique output name each."""
+    entries = []
+    for source in inputs:
+        if os.path.isdir(source):
+            entries.extend({"path": path, "name": relative[:-4]} for path, relative in _pdfs_in(source))
+        elif source.endswith((".txt", ".jsonl")):
+            entries.extend(_read_manifest(source))
+        else:
+            entries.append({"path": source})
+
+    names = set()
+    for entry in entries:
+        base = entry.get("name") or os.path.splitext(os.path.basename(entry["path"]))[0]
+        base = base.replace(os.sep, "__")
+        name, suffix = base, 1
+        while name in names:
+            suffix += 1
+            name = f"{base}-{suffix}"
+        names.add(name)
+        entry["name"] = name
+    return entries
+
+
+async def process_document(entry, output_dir, session, page_slots, render_pool=None):
+    """Analyze one document, write its reports and return its summary."""
+    start_time = time.perf_counter()
+    with open(entry["path"], "rb") as f:
+        pdf_bytes = f.read()
+    results = {}
+    details = {}
+    async for page_num, result, page_details in analyze_pdf_iter(
+        pdf_bytes, start_page=entry.get("start_page", 1), end_page=entry.get("end_page"),
+        pages=entry.get("pages"), session=session, page_slots=page_slots, render_pool=render_pool,
+    ):
+        results[page_num] = result
+        details[page_num] = page_details
+    results = dict(sorted(results.items()))
+
+    report_path = os.path.join(output_dir, f"{entry['name']}.txt")
+    with open(report_path, "w", encoding="utf-8") as f:
+        f.write(results_text(results, details))
+    with open(os.path.join(output_dir, f"{entry['name']}.json"), "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "source": entry["path"],
+                "pages": [{"page": page_num, "result": result, **details[page_num]}
+                          for page_num, result in results.items()],
+            },
+            f, indent=2,
+        )
+    return {
+        "source": entry["path"],
+        "report": report_path,
+        "pages": len(results),
+        "failed": sum(1 for result in results.values() if result in FAILED_RESULTS),
+        "resumed": sum(1 for page in details.values() if page.get("resumed")),
+        "seconds": time.perf_counter() - start_time,
+    }
+
+
+async def run_batch(entries, output_dir, documents=4, concurrency=ANALYSIS_WORKERS):
+    """Process entries with at most documents in flight and concurrency pages under analysis overall."""
+    os.makedirs(output_dir, exist_ok=True)
+    document_slots = asyncio.Semaphore(documents)
+    page_slots = asyncio.Semaphore(concurrency)
+    finished = [0]
+    # One render pool for the whole batch, so process mode does not spawn workers per document
+    render_pool = create_render_pool()
+
+    async with create_http_session() as session:
+
+        async def run_one(entry):
+            async with document_slots:
+                try:
+                    summary = await process_document(entry, output_dir, session, page_slots, render_pool)
+                except Exception as e:
+                    summary = {"source": entry["path"], "error": f"{type(e).__name__}: {e}", "pages": 0,
+                               "failed": 0, "resumed": 0, "seconds": 0.0}
+            finished[0] += 1
+            outcome = summary.get("error") or (
+                f"{summary['pages']} pages, {summary['failed']} failed, {summary['resumed']} resumed"
+            )
+            print(f"[{finished[0]}/{len(entries)}] {entry['path']}: {outcome} ({summary['seconds']:.1f}s)",
+                  file=sys.stderr)
+            return summary
+
+        try:
+            return await asyncio.gather(*(run_one(entry) for entry in entries))
+        finally:
+            render_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate BRD test cases for many documents without the UI.")
+    parser.add_argument("inputs", nargs="+", help="PDF files, directories of PDFs, or .txt/.jsonl manifests")
+    parser.add_argument("--output", default="brd_reports", help="Directory for the per-document reports")
+    parser.add_argument("--documents", type=int, default=4, help="Documents processed at once")
+    parser.add_argument("--concurrency", type=int, default=ANALYSIS_WORKERS,
+                        help="Pages under analysis at once, across all documents")
+    args = parser.parse_args(argv)
+
+    entries = load_documents(args.inputs)
+    if not entries:
+        parser.error("no PDF documents found")
+
+    start_time = time.perf_counter()
+    summaries = asyncio.run(run_batch(entries, args.output, args.documents, args.concurrency))
+    wall_seconds = time.perf_counter() - start_time
+
+    pages = sum(summary["pages"] for summary in summaries)
+    failed = sum(summary["failed"] for summary in summaries)
+    resumed = sum(summary["resumed"] for summary in summaries)
+    errors = sum(1 for summary in summaries if "error" in summary)
+    totals = {
+        "documents": len(summaries),
+        "document_errors": errors,
+        "pages": pages,
+        "failed_pages": failed,
+        "resumed_pages": resumed,
+        "wall_seconds": wall_seconds,
+        # Pages taken from the checkpoint were not analyzed in this run
+        "pages_per_minute": 60.0 * (pages - resumed) / wall_seconds if wall_seconds else 0.0,
+    }
+    with open(os.path.join(args.output, "summary.json"), "w") as f:
+        json.dump({"totals": totals, "documents": summaries}, f, indent=2)
+
+    print(
+        f"{totals['documents']} documents ({errors} failed), {pages} pages ({failed} failed, "
+        f"{totals['resumed_pages']} resumed) in {wall_seconds:.1f}s: {totals['pages_per_minute']:.1f} pages/min"
+    )
+    print(f"Reports written to {args.output}")
+    return 1 if errors or failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
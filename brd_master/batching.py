@@ -0,0 +1,85 @@
+import asyncio
+import contextlib
+import os
+
+from dotenv import load_dotenv
+
+from brd_master.analyze_image import MAX_TOKENS, analyze_pages
+
+load_dotenv()
+
+# Consecutive pages packed into one model request; 1 sends every page on its own
+BATCH_PAGES = int(os.getenv("BRD_BATCH_PAGES", "1"))
+# Estimated input tokens of the pages in one request (images and extracted text)
+BATCH_MAX_TOKENS = int(os.getenv("BRD_BATCH_MAX_TOKENS", "6000"))
+# Output tokens one request may ask for; each page is allowed MAX_TOKENS of them
+BATCH_MAX_OUTPUT_TOKENS = int(os.getenv("BRD_BATCH_MAX_OUTPUT_TOKENS", "4096"))
+
+BATCH_SIZE = max(1, min(BATCH_PAGES, BATCH_MAX_OUTPUT_TOKENS // MAX_TOKENS))
+
+
+def page_tokens(page):
+    """Estimated input tokens of a prepared page."""
+    if "text" in page:
+        return len(page["text"]) // 4
+    return page["image_tokens"]
+
+
+def fits(batch, page, size=BATCH_SIZE, max_tokens=BATCH_MAX_TOKENS):
+    """Whether page can join batch, a list of (page_index, page), without exceeding the limits."""
+    if len(batch) >= size:
+        return False
+    return sum(page_tokens(member) for _, member in batch) + page_tokens(page) <= max_tokens
+
+
+class PageBatch:
+    """Analyzes the pages of one batch in a single request.
+
+    Every page of the batch calls analyze() in the same event-loop turn (through the
+    deduplicator, so duplicates of earlier pages never join). The first caller waits one
+    turn for the others and sends them together; a page arriving later, such as the copy
+    of a page whose analysis failed, starts a batch of its own. If the response cannot
+    be split per page, each page falls back to analyze_single(page_num, page). A
+    multi-page request holds one of page_slots (an asyncio.Semaphore), if given.
+    """
+
+    def __init__(self, session, model_id, analyze_single, page_slots=None):
+        self.session = session
+        self.model_id = model_id
+        self.analyze_single = analyze_single
+        self.page_slots = page_slots
+        self._pending = []  # (page_num, page, future)
+
+    async def analyze(self, page_num, page):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((page_num, page, future))
+        if len(self._pending) == 1:
+            await asyncio.sleep(0)
+            members, self._pending = self._pending, []
+            try:
+                await self._send(members)
+            except Exception as e:
+                for _, _, member_future in members:
+                    if not member_future.done():
+                        member_future.set_exception(e)
+                raise
+            finally:
+                for _, _, member_future in members:
+                    if not member_future.done():
+                        member_future.cancel()
+        return await future
+
+    async def _send(self, members):
+        results = None
+        if len(members) > 1:
+            async with self.page_slots or contextlib.nullcontext():
+                results = await analyze_pages(
+                    self.session, self.model_id, [{"page_num": page_num, **page} for page_num, page, _ in members]
+                )
+        if results is None:
+            results = await asyncio.gather(
+                *(self.analyze_single(page_num, page) for page_num, page, _ in members)
+            )
+            results = dict(zip((page_num for page_num, _, _ in members), results))
+        for page_num, _, future in members:
+            future.set_result(results[page_num])
@@ -1,21 +1,16 @@
-import asyncio
-import os
-from remove_pages import remove_preceding_pages
-from analyze_pdf import analyze_pdf
+import fitz
+from brd_master.analyze_pdf import analyze_pdf
+from brd_master.remove_pages import select_pages
 
 
-async def main(pdf_bytes, start_page, output_path):
-    temp_pdf_path = "temp_pdf.pdf"
-    with open(temp_pdf_path, "wb") as temp_pdf_file:
-        temp_pdf_file.write(pdf_bytes)
+async def main(pdf_bytes, start_page, output_path=None):
+    results = await analyze_pdf(pdf_bytes, start_page=start_page)
 
-    remove_preceding_pages(temp_pdf_path, start_page, output_path)
-
-    with open(output_path, "rb") as modified_pdf_file:
-        modified_pdf_bytes = modified_pdf_file.read()
-
-    results = await analyze_pdf(modified_pdf_bytes)
-
-    os.remove(temp_pdf_path)
+    # Optionally keep a copy of the analyzed pages, as the previous file-based flow did
+    if output_path:
+        document = fitz.open(stream=pdf_bytes, filetype="pdf")
+        document.select(select_pages(len(document), start_page))
+        document.save(output_path)
+        document.close()
 
     return results
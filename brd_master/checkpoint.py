@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Finished page results are stored as they complete so an interrupted run can resume
+CHECKPOINT_ENABLED = os.getenv("BRD_CHECKPOINT", "true").lower() in ("1", "true", "yes")
+CHECKPOINT_DIR = os.getenv("BRD_CHECKPOINT_DIR", ".cache/brd_runs")
+CHECKPOINT_TTL = int(os.getenv("BRD_CHECKPOINT_TTL", str(7 * 24 * 3600)))
+
+# Results that mean the page was not analyzed and should be retried on the next run
+FAILED_RESULTS = (None, "", "No content", "Error checking guardrails")
+
+
+def prompt_version(*parts):
+    """Short hash identifying the prompt text(s) a result was produced with."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:16]
+
+
+class RunCheckpoint:
+    """SQLite store of finished BRD page results.
+
+    Rows are keyed on document hash, page number, prompt version and model id, so a
+    re-run of the same upload with the same prompt and model only analyzes the pages
+    that are missing or failed.
+    """
+
+    def __init__(self, checkpoint_dir=CHECKPOINT_DIR, ttl=CHECKPOINT_TTL, enabled=CHECKPOINT_ENABLED):
+        self.checkpoint_dir = checkpoint_dir
+        self.ttl = ttl
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(self.checkpoint_dir, exist_ok=True)
+            self._conn = sqlite3.connect(
+                os.path.join(self.checkpoint_dir, "pages.sqlite3"), check_same_thread=False
+            )
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                "doc_id TEXT, page_num INTEGER, prompt_version TEXT, model_id TEXT, "
+                "result TEXT, details TEXT, completed REAL, "
+                "PRIMARY KEY (doc_id, page_num, prompt_version, model_id))"
+            )
+            self._conn.execute("DELETE FROM pages WHERE completed <= ?", (time.time() - self.ttl,))
+            self._conn.commit()
+        return self._conn
+
+    def load(self, doc_id, prompt_version, model_id):
+        """Return {page_num: (result, details)} for the pages already analyzed successfully."""
+        if not self.enabled:
+            return {}
+        with self._lock:
+            try:
+                rows = self._connect().execute(
+                    "SELECT page_num, result, details FROM pages "
+                    "WHERE doc_id = ? AND prompt_version = ? AND model_id = ?",
+                    (doc_id, prompt_version, model_id),
+                ).fetchall()
+            except sqlite3.Error as e:
+                print(f"BRD checkpoint read failed: {e}")
+                return {}
+        return {page_num: (result, json.loads(details)) for page_num, result, details in rows}
+
+    def save(self, doc_id, prompt_version, model_id, page_num, result, details):
+        """Record a finished page; failed pages are not stored, so they are retried."""
+        if not self.enabled or result in FAILED_RESULTS:
+            return
+        with self._lock:
+            try:
+                conn = self._connect()
+                conn.execute(
+                    "INSERT OR REPLACE INTO pages "
+                    "(doc_id, page_num, prompt_version, model_id, result, details, completed) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (doc_id, page_num, prompt_version, model_id, result, json.dumps(details), time.time()),
+                )
+                conn.commit()
+            except sqlite3.Error as e:
+                print(f"BRD checkpoint write failed: {e}")
+
+
+# Create global checkpoint instance
+checkpoint = RunCheckpoint()
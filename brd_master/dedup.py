@@ -0,0 +1,103 @@
+import asyncio
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from dotenv import load_dotenv
+
+from brd_master.checkpoint import FAILED_RESULTS
+
+load_dotenv()
+
+# Pages whose fingerprints match share one analysis instead of one model call each
+DEDUP_ENABLED = os.getenv("BRD_DEDUP", "true").lower() in ("1", "true", "yes")
+# Largest perceptual-hash Hamming distance (of 256 bits) still treated as the same page
+DEDUP_MAX_DISTANCE = int(os.getenv("BRD_DEDUP_MAX_DISTANCE", "6"))
+# Distinct page texts remembered per process; the least recently matched are forgotten first
+DEDUP_MAX_ENTRIES = int(os.getenv("BRD_DEDUP_MAX_ENTRIES", "10000"))
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class PageDeduplicator:
+    """Shares one analysis between exact and near-duplicate pages, within and across documents.
+
+    Fingerprints are (dhash, text_hash) from DocumentService.page_fingerprint(); they do
+    not depend on the page number. Pages match when their normalised text is identical
+    and their images are within max_distance bits. The first page of a group is analyzed;
+    later copies, in the same or another document, wait for its result. Failed analyses
+    are forgotten so the next copy gets its own attempt. Safe to share between threads
+    and event loops.
+    """
+
+    def __init__(self, max_distance=DEDUP_MAX_DISTANCE, max_entries=DEDUP_MAX_ENTRIES):
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # text_hash -> [(dhash, doc_id, page_num, future)], least recently matched first
+        self._groups = OrderedDict()
+
+    def _find(self, fingerprint):
+        dhash, text_hash = fingerprint
+        best = None
+        for candidate in self._groups.get(text_hash, []):
+            distance = hamming(dhash, candidate[0])
+            if distance <= self.max_distance and (best is None or distance < best[0]):
+                best = (distance, candidate)
+        if best is None:
+            return None
+        self._groups.move_to_end(text_hash)
+        return best[1]
+
+    def _add(self, fingerprint, entry):
+        self._groups.setdefault(fingerprint[1], []).append(entry)
+        self._groups.move_to_end(fingerprint[1])
+        while len(self._groups) > self.max_entries:
+            self._groups.popitem(last=False)
+
+    def _forget(self, fingerprint, entry):
+        with self._lock:
+            group = self._groups.get(fingerprint[1])
+            if group is not None and entry in group:
+                group.remove(entry)
+                if not group:
+                    del self._groups[fingerprint[1]]
+
+    def clear(self):
+        with self._lock:
+            self._groups.clear()
+
+    async def run(self, doc_id, page_num, fingerprint, analyze):
+        """Return (result, original): analyze()'s result and None, or the reused result and the
+        (doc_id, page_num) of the page this one duplicates."""
+        if fingerprint is None:
+            return await analyze(), None
+        future = Future()
+        entry = (fingerprint[0], doc_id, page_num, future)
+        with self._lock:
+            original = self._find(fingerprint)
+            if original is None:
+                self._add(fingerprint, entry)
+        if original is not None:
+            _, original_doc, original_page, original_future = original
+            result = await asyncio.shield(asyncio.wrap_future(original_future))
+            # A failed original is not reused; this copy gets its own attempt
+            if result not in FAILED_RESULTS:
+                return result, (original_doc, original_page)
+            return await analyze(), None
+
+        result = None
+        try:
+            result = await analyze()
+            return result, None
+        finally:
+            if result in FAILED_RESULTS:
+                self._forget(fingerprint, entry)
+            future.set_result(result)
+
+
+# Create global deduplicator instance
+page_dedup = PageDeduplicator()
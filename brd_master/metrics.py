@@ -1,5 +1,10 @@
 # metrics.py
-from prometheus_client import Counter, Summary, REGISTRY
+import time
+
+from common.metrics import LATENCY_BUCKETS, STAGE_BUCKETS, Counter, Histogram, get_or_create
+
+# Request bodies carry a base64 page image; responses are a few KB of text
+BYTE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
 
 class MetricsSingleton:
     _instance = None
@@ -12,29 +17,41 @@ class MetricsSingleton:
 
     def __init__(self):
         if not self._initialized:
-            # Clear any existing metrics with these names
-            collectors_to_remove = []
-            for collector in REGISTRY._collector_to_names:
-                for name in REGISTRY._collector_to_names[collector]:
-                    if name in [
-                        "request_processing_seconds",
-                        "processed_pdfs_total",
-                        "analyzed_pages_total",
-                        "analysis_errors_total",
-                        "analysis_duration_seconds"
-                    ]:
-                        collectors_to_remove.append(collector)
-            
-            for collector in collectors_to_remove:
-                REGISTRY.unregister(collector)
-
-            # Create new metrics
-            self.request_time = Summary("request_processing_seconds", "Time spent processing request")
-            self.processed_pdfs = Counter("processed_pdfs_total", "Total number of PDFs processed")
-            self.analyzed_pages = Counter("analyzed_pages_total", "Total number of pages analyzed")
-            self.analysis_errors = Counter("analysis_errors_total", "Total number of analysis errors")
-            self.analysis_duration = Summary("analysis_duration_seconds", "Time spent analyzing each page")
-            
+            self.request_time = get_or_create(
+                Histogram, "request_processing_seconds", "Time spent processing request",
+                buckets=LATENCY_BUCKETS + (600, 1800),
+            )
+            self.processed_pdfs = get_or_create(Counter, "processed_pdfs_total", "Total number of PDFs processed")
+            self.analyzed_pages = get_or_create(Counter, "analyzed_pages_total", "Total number of pages analyzed")
+            self.page_modes = get_or_create(
+                Counter, "page_analysis_mode_total", "Pages sent to the model as an image or as text", ["mode"]
+            )
+            self.deduplicated_pages = get_or_create(
+                Counter, "deduplicated_pages_total", "Pages that reused the analysis of a duplicate page"
+            )
+            self.analysis_errors = get_or_create(Counter, "analysis_errors_total", "Total number of analysis errors")
+            self.analysis_duration = get_or_create(
+                Histogram, "analysis_duration_seconds", "Time spent analyzing each page",
+                buckets=LATENCY_BUCKETS,
+            )
+            # render, encode and parse are our CPU; guardrail and model are Bedrock round-trips
+            self.stage_duration = get_or_create(
+                Histogram, "brd_stage_seconds", "Time spent in each stage of a page analysis",
+                ["stage", "model", "outcome"], buckets=STAGE_BUCKETS,
+            )
+            self.request_bytes = get_or_create(
+                Histogram, "brd_model_request_bytes", "Size of page analysis request bodies",
+                ["model", "outcome"], buckets=BYTE_BUCKETS,
+            )
+            self.response_bytes = get_or_create(
+                Histogram, "brd_model_response_bytes", "Size of page analysis responses",
+                ["model", "outcome"], buckets=BYTE_BUCKETS,
+            )
+            self.page_retries = get_or_create(
+                Histogram, "brd_page_retries", "Model call retries per analyzed page",
+                ["model", "outcome"], buckets=(0, 1, 2, 3, 4, 5, 10),
+            )
+
             self._initialized = True
 
 # Create global metrics instance
@@ -52,4 +69,20 @@ class AsyncTimer:
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         import time
         duration = time.time() - self._start_time
-        self._summary_metric.observe(duration)
\ No newline at end of file
+        self._summary_metric.observe(duration)
+
+# Context manager timing one stage of a page analysis; the outcome is "error" if it raised
+class StageTimer:
+    def __init__(self, stage, model_id):
+        self._stage = stage
+        self._model_id = model_id
+
+    def __enter__(self):
+        self._start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.observe(time.perf_counter() - self._start_time, "error" if exc_type else "ok")
+
+    def observe(self, seconds, outcome="ok"):
+        metrics.stage_duration.labels(self._stage, self._model_id, outcome).observe(seconds)
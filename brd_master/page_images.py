@@ -0,0 +1,88 @@
+import math
+import os
+
+from dotenv import load_dotenv
+
+from common.documents import documents
+
+load_dotenv()
+
+# Output format: png, jpeg (or jpg), webp, or auto (PNG for text-only pages, JPEG for pages with images or drawings)
+IMAGE_FORMAT = os.getenv("BRD_IMAGE_FORMAT", "auto").lower()
+IMAGE_QUALITY = int(os.getenv("BRD_IMAGE_QUALITY", "80"))
+# Target resolution; lowered when the page would exceed the edge or token limits below
+IMAGE_DPI = int(os.getenv("BRD_IMAGE_DPI", "72"))
+IMAGE_MAX_EDGE = int(os.getenv("BRD_IMAGE_MAX_EDGE", "1568"))
+IMAGE_MAX_TOKENS = int(os.getenv("BRD_IMAGE_MAX_TOKENS", "1600"))
+# auto: grayscale for pages without embedded images or vector drawings
+IMAGE_GRAYSCALE = os.getenv("BRD_IMAGE_GRAYSCALE", "auto").lower()
+
+# Pages with a usable text layer and no visuals go to the model as text instead of an image
+TEXT_FAST_PATH = os.getenv("BRD_TEXT_FAST_PATH", "true").lower() in ("1", "true", "yes")
+TEXT_MIN_CHARS = int(os.getenv("BRD_TEXT_MIN_CHARS", "200"))
+TEXT_MIN_COVERAGE = float(os.getenv("BRD_TEXT_MIN_COVERAGE", "0.1"))
+# Rules, underlines and boxes up to this many vector paths still count as a text page
+TEXT_MAX_DRAWINGS = int(os.getenv("BRD_TEXT_MAX_DRAWINGS", "10"))
+
+TEXT = "text"
+IMAGE = "image"
+
+# Claude bills an image at roughly width * height / 750 input tokens
+PIXELS_PER_TOKEN = 750
+MEDIA_TYPES = {"png": "image/png", "jpeg": "image/jpeg", "jpg": "image/jpeg", "webp": "image/webp"}
+
+
+def image_tokens(width, height):
+    return math.ceil(width * height / PIXELS_PER_TOKEN)
+
+
+def page_dpi(width_pt, height_pt, dpi=IMAGE_DPI, max_edge=IMAGE_MAX_EDGE, max_tokens=IMAGE_MAX_TOKENS):
+    """Highest resolution up to dpi at which the page fits max_edge pixels and max_tokens."""
+    dpi = min(dpi, max_edge * 72 / max(width_pt, height_pt))
+    dpi = min(dpi, 72 * math.sqrt(max_tokens * PIXELS_PER_TOKEN / (width_pt * height_pt)))
+    return max(1, int(dpi))
+
+
+def page_mode(doc_id, page_index):
+    """Return TEXT if the page can be analyzed from its text layer, else IMAGE.
+
+    A text page embeds no images, has at most TEXT_MAX_DRAWINGS vector drawings, enough
+    extracted text covering enough of the page, and no detected tables (whose layout the
+    extracted text would lose).
+    """
+    if not TEXT_FAST_PATH:
+        return IMAGE
+    info = documents.page_info(doc_id, page_index)
+    if (
+        info["images"]
+        or info["drawings"] > TEXT_MAX_DRAWINGS
+        or info["text_chars"] < TEXT_MIN_CHARS
+        or info["text_coverage"] < TEXT_MIN_COVERAGE
+    ):
+        return IMAGE
+    # Table detection is the expensive check, so it runs last
+    if documents.page_table_count(doc_id, page_index):
+        return IMAGE
+    return TEXT
+
+
+def page_encoding(doc_id, page_index):
+    """Choose how one page is sent to the model.
+
+    Returns (render_kwargs, media_type, tokens): keyword arguments for
+    documents.render_page(), the image media type and the estimated image tokens.
+    """
+    info = documents.page_info(doc_id, page_index)
+    dpi = page_dpi(info["width"], info["height"])
+    # Vector diagrams can be colour-coded too; a few rules and boxes still count as text
+    text_only = not info["images"] and info["drawings"] <= TEXT_MAX_DRAWINGS
+    if IMAGE_GRAYSCALE == "auto":
+        grayscale = text_only
+    else:
+        grayscale = IMAGE_GRAYSCALE in ("1", "true", "yes")
+    fmt = IMAGE_FORMAT
+    if fmt == "auto":
+        fmt = "png" if text_only else "jpeg"
+    render_kwargs = {"dpi": dpi, "fmt": fmt, "quality": IMAGE_QUALITY, "grayscale": grayscale}
+    tokens = image_tokens(info["width"] * dpi / 72, info["height"] * dpi / 72)
+    return render_kwargs, MEDIA_TYPES[fmt], tokens
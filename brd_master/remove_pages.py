@@ -2,19 +2,38 @@ import fitz
 import os
 
 
-def remove_preceding_pages(pdf_path, start_page, output_path):
-    document = fitz.open(pdf_path)
-    new_document = fitz.open()
+def select_pages(page_count, start_page=1, end_page=None, pages=None):
+    """Return the 0-based indices of the requested 1-based pages, in order and without repeats.
+
+    pages, if given, is an explicit list of page numbers and takes precedence over the
+    start_page..end_page range (end_page defaults to the last page).
+    """
+    if pages is None:
+        end_page = page_count if end_page is None else end_page
+        if start_page < 1 or start_page > page_count:
+            raise ValueError("Invalid start page number.")
+        if end_page < start_page or end_page > page_count:
+            raise ValueError("Invalid end page number.")
+        pages = range(start_page, end_page + 1)
+    indices = []
+    seen = set()
+    for page_num in pages:
+        if page_num < 1 or page_num > page_count:
+            raise ValueError(f"Invalid page number {page_num}.")
+        if page_num not in seen:
+            seen.add(page_num)
+            indices.append(page_num - 1)
+    if not indices:
+        raise ValueError("No pages selected.")
+    return indices
 
-    if start_page < 1 or start_page > len(document):
-        raise ValueError("Invalid start page number.")
 
-    for page_num in range(start_page - 1, len(document)):
-        new_document.insert_pdf(document, from_page=page_num, to_page=page_num)
+def remove_preceding_pages(pdf_path, start_page, output_path):
+    document = fitz.open(pdf_path)
+    document.select(select_pages(len(document), start_page))
 
     temp_output_path = output_path + ".temp"
-    new_document.save(temp_output_path)
-    new_document.close()
+    document.save(temp_output_path)
     document.close()
 
     os.replace(temp_output_path, output_path)
@@ -0,0 +1,31 @@
+# Plain-text BRD reports, shared by the Streamlit app and the batch CLI
+
+
+def results_text(results, details=None):
+    # Prepare results for download
+    details = details or {}
+    result_text = ""
+    for page_num, result in results.items():
+        result_text += f"Page {page_num}{page_note(details.get(page_num))}:\n"
+        if result:
+            result_text += f"{result}\n\n"
+        else:
+            result_text += "Failed to analyze this page.\n\n"
+    return result_text
+
+
+def page_details(partials):
+    # How each finished page was analyzed: "mode" (text or image), "duplicate_of" and "duplicate_document"
+    return {partial["page"]: partial for partial in partials if "result" in partial}
+
+
+def page_note(details):
+    if not details:
+        return ""
+    if details.get("duplicate_document"):
+        return f" (duplicate of Page {details['duplicate_of']} of document {details['duplicate_document'][:12]})"
+    if details.get("duplicate_of"):
+        return f" (duplicate of Page {details['duplicate_of']})"
+    if details.get("mode") == "text":
+        return " (from the text layer)"
+    return ""
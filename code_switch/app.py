@@ -1,5 +1,7 @@
 import streamlit as st
-from code_switch.functions import convert_code, generate_documentation, check_syntax
+from code_switch.functions import (
+    check_syntax, convert_code_stream, generate_documentation_stream, parse_llm_response,
+)
 from code_switch.language_detection import detect_language
 
 def main():
@@ -69,13 +71,17 @@ Simply upload or paste your code below to get started!
 
         if st.button("Convert Code"):
             if detected_language != "Unknown":
-                with st.spinner("Converting..."):
-                    converted_code = convert_code(
-                        source_code, detected_language, target_language
+                # Show the response as it is generated, then replace it with the parsed code
+                placeholder = st.empty()
+                with placeholder:
+                    response = st.write_stream(
+                        convert_code_stream(source_code, detected_language, target_language)
                     )
-                    st.session_state.converted_code = converted_code
-                    st.session_state.documentation = ""
-                    st.session_state.syntax_result = ""
+                placeholder.empty()
+                converted_code = parse_llm_response(response, "Convert")
+                st.session_state.converted_code = converted_code
+                st.session_state.documentation = ""
+                st.session_state.syntax_result = ""
 
         # Use containers for better spacing
         with st.container():
@@ -111,11 +117,14 @@ Simply upload or paste your code below to get started!
 
                 # Generate Explanation button appears after syntax result
                 if st.button("Generate Explanation"):
-                    with st.spinner("Generating..."):
-                        documentation = generate_documentation(
-                            st.session_state.converted_code, target_language
+                    placeholder = st.empty()
+                    with placeholder:
+                        response = st.write_stream(
+                            generate_documentation_stream(st.session_state.converted_code, target_language)
                         )
-                        st.session_state.documentation = documentation
+                    placeholder.empty()
+                    documentation = parse_llm_response(response, "Documentation")
+                    st.session_state.documentation = documentation
 
         # Display Code Explanation
         if st.session_state.documentation:
@@ -2,42 +2,86 @@ import os
 import json
 import re
 import subprocess
-import ast, boto3
+import ast
 import requests
+from functools import lru_cache
 from langchain_community.llms import Bedrock
 from dotenv import load_dotenv
+from common.bedrock import get_bedrock_client, invoke_model_stream
+from common.llm_cache import llm_cache, make_key
+from common.metrics import track_request
+from common.scheduler import INTERACTIVE, scheduler
+from common.usage import budget, capture_usage, estimate_tokens, usage_tracker
 from code_switch.prompts import get_conversion_prompt, get_documentation_prompt
 
 load_dotenv()
 
-
-def get_bedrock_client():
-    return boto3.client(
-        "bedrock-runtime",
-        region_name=os.getenv("AWS_REGION"),
-        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-    )
+MODEL_ID = "mistral.mistral-large-2402-v1:0"
+MODEL_KWARGS = {
+    "max_tokens": 2048,
+    "temperature": 0.3,
+    "top_k": 50,
+    "top_p": 0.9,
+}
 
 
+@lru_cache(maxsize=1)
 def get_custom_llm():
-    model_id = "mistral.mistral-large-2402-v1:0"
-    model_kwargs = {
-        "max_tokens": 2048,
-        "temperature": 0.3,
-        "top_k": 50,
-        "top_p": 0.9,
-    }
     client = get_bedrock_client()
-    custom_llm = Bedrock(client=client, model_id=model_id, model_kwargs=model_kwargs)
+    custom_llm = Bedrock(client=client, model_id=MODEL_ID, model_kwargs=MODEL_KWARGS)
     return custom_llm
 
 
-def convert_code(code, source_language, target_language):
-    custom_llm = get_custom_llm()
-    prompt = get_conversion_prompt(source_language, target_language, code)
-    response = custom_llm(prompt)
-    print("Convert Response:", response)  # Debugging
+def invoke_llm(prompt):
+    """Call the LLM, reusing the cached response for an identical prompt."""
+    cache_key = make_key(MODEL_ID, MODEL_KWARGS, prompt)
+    response = llm_cache.get("code_switch", cache_key)
+    if response is None:
+        reservation = budget.acquire("code_switch", estimate_tokens(prompt, max_output_tokens=MODEL_KWARGS["max_tokens"]))
+        try:
+            with scheduler.slot("code_switch", INTERACTIVE), track_request("code_switch", MODEL_ID) as call, \
+                    capture_usage() as captured:
+                call.sent(len(prompt.encode("utf-8")))
+                response = get_custom_llm()(prompt)
+                call.received(len(response.encode("utf-8")))
+            usage_tracker.record(
+                "code_switch", MODEL_ID,
+                captured.input_tokens if captured.input_tokens is not None else estimate_tokens(prompt),
+                captured.output_tokens if captured.output_tokens is not None else estimate_tokens(response),
+                call.bytes_sent, call.bytes_received, reservation=reservation,
+            )
+        finally:
+            budget.release(reservation)
+        llm_cache.set("code_switch", cache_key, response)
+    return response
+
+
+def stream_llm(prompt):
+    """Yield the LLM response as it is generated; the full response is cached like invoke_llm."""
+    cache_key = make_key(MODEL_ID, MODEL_KWARGS, prompt)
+    response = llm_cache.get("code_switch", cache_key)
+    if response is not None:
+        yield response
+        return
+    reservation = budget.acquire("code_switch", estimate_tokens(prompt, max_output_tokens=MODEL_KWARGS["max_tokens"]))
+    try:
+        # Same request body langchain's Bedrock wrapper sends for Mistral models
+        with scheduler.slot("code_switch", INTERACTIVE), track_request("code_switch", MODEL_ID) as call:
+            stream = invoke_model_stream(MODEL_ID, {"prompt": prompt, **MODEL_KWARGS}, call=call)
+            yield from stream
+        response = stream.text
+        input_tokens, output_tokens = stream.usage or (estimate_tokens(prompt), estimate_tokens(response))
+        usage_tracker.record(
+            "code_switch", MODEL_ID, input_tokens, output_tokens, call.bytes_sent, call.bytes_received,
+            reservation=reservation,
+        )
+    finally:
+        budget.release(reservation)
+    llm_cache.set("code_switch", cache_key, response)
+
+
+def parse_llm_response(response, label):
+    print(f"{label} Response:", response)  # Debugging
     try:
         response_dict = json.loads(response)
         if "text" in response_dict:
@@ -46,25 +90,28 @@ def convert_code(code, source_language, target_language):
             print("Error: 'text' key not found in the response.")
             return "Error: 'text' key not found in the response."
     except json.JSONDecodeError:
-        print("Convert Response is not JSON. Returning raw response.")
+        print(f"{label} Response is not JSON. Returning raw response.")
         return response
 
 
+def convert_code(code, source_language, target_language):
+    prompt = get_conversion_prompt(source_language, target_language, code)
+    return parse_llm_response(invoke_llm(prompt), "Convert")
+
+
+def convert_code_stream(code, source_language, target_language):
+    """Stream the raw conversion response; pass the joined text to parse_llm_response."""
+    return stream_llm(get_conversion_prompt(source_language, target_language, code))
+
+
 def generate_documentation(code, language):
-    custom_llm = get_custom_llm()
     prompt = get_documentation_prompt(language, code)
-    response = custom_llm(prompt)
-    print("Documentation Response:", response)  # Debugging
-    try:
-        response_dict = json.loads(response)
-        if "text" in response_dict:
-            return response_dict["text"]
-        else:
-            print("Error: 'text' key not found in the response.")
-            return "Error: 'text' key not found in the response."
-    except json.JSONDecodeError:
-        print("Documentation Response is not JSON. Returning raw response.")
-        return response
+    return parse_llm_response(invoke_llm(prompt), "Documentation")
+
+
+def generate_documentation_stream(code, language):
+    """Stream the raw documentation response; pass the joined text to parse_llm_response."""
+    return stream_llm(get_documentation_prompt(language, code))
 
 
 def check_syntax_cpp(code):
@@ -0,0 +1,22 @@
+# common/__init__.py
+# Shared infrastructure used by all sub-applications (Bedrock clients, caching, metrics).
+import atexit
+import os
+import shutil
+import sys
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Job and render workers are spawned processes, so their samples reach the exporter only
+# through PROMETHEUS_MULTIPROC_DIR, which prometheus_client reads when it is first imported.
+# Every common module is imported after this package, so unless it is configured the app
+# process gets its own directory here, before any metric or pool exists; workers inherit
+# the variable and the directory is removed when the app exits.
+if not os.getenv("PROMETHEUS_MULTIPROC_DIR") and "prometheus_client" not in sys.modules:
+    _multiproc_dir = os.path.abspath(os.path.join(".cache", "prometheus", str(os.getpid())))
+    shutil.rmtree(_multiproc_dir, ignore_errors=True)
+    os.makedirs(_multiproc_dir)
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = _multiproc_dir
+    atexit.register(shutil.rmtree, _multiproc_dir, ignore_errors=True)
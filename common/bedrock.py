@@ -0,0 +1,377 @@
+# bedrock.py
+import asyncio
+import base64
+import json
+import os
+import threading
+import time
+
+import aiohttp
+import boto3
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from botocore.config import Config
+from botocore.eventstream import EventStreamBuffer
+from dotenv import load_dotenv
+
+from common.usage import register_usage_hook, usage_from_response
+
+try:
+    import orjson
+except ImportError:  # Optional: faster decoding of Bedrock response bodies
+    orjson = None
+
+load_dotenv()
+
+# Connection pool and keep-alive settings shared by every Bedrock client
+MAX_POOL_CONNECTIONS = int(os.getenv("BEDROCK_MAX_POOL_CONNECTIONS", "50"))
+READ_TIMEOUT = int(os.getenv("BEDROCK_READ_TIMEOUT", "120"))
+HTTP_CONNECTION_LIMIT = int(os.getenv("BEDROCK_HTTP_CONNECTION_LIMIT", "100"))
+# 0 means no per-host limit beyond HTTP_CONNECTION_LIMIT
+HTTP_LIMIT_PER_HOST = int(os.getenv("BEDROCK_HTTP_LIMIT_PER_HOST", "0"))
+HTTP_KEEPALIVE_TIMEOUT = int(os.getenv("BEDROCK_HTTP_KEEPALIVE_TIMEOUT", "60"))
+HTTP_DNS_CACHE_TTL = int(os.getenv("BEDROCK_HTTP_DNS_CACHE_TTL", "300"))
+HTTP_CONNECT_TIMEOUT = int(os.getenv("BEDROCK_HTTP_CONNECT_TIMEOUT", "10"))
+
+BEDROCK_MODE = os.getenv("BEDROCK_MODE", "live").lower()
+
+_lock = threading.RLock()
+_session = None
+_clients = {}
+
+
+def loads(data):
+    """Parse a JSON response body, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _timed_loads(data, call=None):
+    """loads(), with the time spent recorded on call (see common.metrics.track_request)."""
+    if call is None:
+        return loads(data)
+    start_time = time.perf_counter()
+    try:
+        return loads(data)
+    finally:
+        call.parsed(time.perf_counter() - start_time)
+
+
+class BedrockHTTPError(Exception):
+    """Non-2xx response from a signed Bedrock HTTP call."""
+
+    def __init__(self, status, body, retry_after=None):
+        super().__init__(f"Bedrock returned HTTP {status}: {body}")
+        self.status = status
+        self.body = body
+        self.retry_after = retry_after
+
+
+def get_session():
+    """Return the process-wide boto3 session (credentials are resolved once)."""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = boto3.Session(
+                    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+                    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+                    aws_session_token=os.getenv("AWS_SESSION_TOKEN"),
+                    region_name=os.getenv("AWS_REGION"),
+                )
+    return _session
+
+
+def get_region():
+    return get_session().region_name or os.getenv("AWS_REGION")
+
+
+def get_bedrock_client(service_name="bedrock-runtime"):
+    """Return the shared, thread-safe boto3 client for a Bedrock service."""
+    client = _clients.get(service_name)
+    if client is None:
+        with _lock:
+            client = _clients.get(service_name)
+            if client is None:
+                config = Config(
+                    max_pool_connections=MAX_POOL_CONNECTIONS,
+                    tcp_keepalive=True,
+                    read_timeout=READ_TIMEOUT,
+                    retries={"max_attempts": 3, "mode": "adaptive"},
+                )
+                if BEDROCK_MODE in ("replay", "fake"):
+                    client = None
+                else:
+                    client = get_session().client(service_name, config=config)
+                    register_usage_hook(client)
+                if BEDROCK_MODE in ("record", "replay", "fake"):
+                    from common.bedrock_standin import StandInBedrockClient
+
+                    client = StandInBedrockClient(client, BEDROCK_MODE)
+                _clients[service_name] = client
+    return client
+
+
+def invoke_model(model_id, body, call=None, client=None, **kwargs):
+    """Invoke a model and return (parsed JSON body, (input_tokens, output_tokens) or None).
+
+    Uses client, or the shared bedrock-runtime client. Pass the object yielded by
+    common.metrics.track_request as call to count payload bytes.
+    """
+    if not isinstance(body, (str, bytes)):
+        body = json.dumps(body)
+    if call is not None:
+        call.sent(len(body))
+    response = (client or get_bedrock_client()).invoke_model(
+        modelId=model_id, body=body, contentType="application/json", **kwargs
+    )
+    raw = response["body"].read()
+    if call is not None:
+        call.received(len(raw))
+    response_body = _timed_loads(raw, call)
+    headers = response.get("ResponseMetadata", {}).get("HTTPHeaders")
+    return response_body, usage_from_response(headers, response_body)
+
+
+async def invoke_model_async(model_id, body, call=None, client=None, **kwargs):
+    """Async face of invoke_model; the blocking call runs in a worker thread."""
+    return await asyncio.to_thread(invoke_model, model_id, body, call, client, **kwargs)
+
+
+def stream_delta(chunk):
+    """Return the text added by one response-stream chunk (Claude messages or Mistral)."""
+    if chunk.get("type") == "content_block_delta":
+        return chunk.get("delta", {}).get("text", "")
+    if "outputs" in chunk:
+        return "".join(output.get("text", "") for output in chunk["outputs"])
+    return ""
+
+
+class ModelStream:
+    """Text deltas of a streamed completion, iterable with for or async for.
+
+    Once exhausted, text holds the whole completion and input_tokens/output_tokens the
+    usage Bedrock reports in the final chunk.
+    """
+
+    def __init__(self, chunks, call=None):
+        self._chunks = chunks
+        self._call = call
+        self._parts = []
+        self.input_tokens = None
+        self.output_tokens = None
+
+    def _consume(self, chunk):
+        invocation_metrics = chunk.get("amazon-bedrock-invocationMetrics")
+        if invocation_metrics:
+            self.input_tokens = invocation_metrics.get("inputTokenCount")
+            self.output_tokens = invocation_metrics.get("outputTokenCount")
+        delta = stream_delta(chunk)
+        if delta:
+            if self._call is not None:
+                self._call.first_token()
+            self._parts.append(delta)
+        return delta
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            delta = self._consume(chunk)
+            if delta:
+                yield delta
+
+    async def _aiter(self):
+        async for chunk in self._chunks:
+            delta = self._consume(chunk)
+            if delta:
+                yield delta
+
+    def __aiter__(self):
+        return self._aiter()
+
+    @property
+    def text(self):
+        return "".join(self._parts)
+
+    @property
+    def usage(self):
+        if self.input_tokens is None:
+            return None
+        return self.input_tokens, self.output_tokens or 0
+
+
+def _stream_chunks(events, call=None):
+    for event in events:
+        if "chunk" not in event:
+            continue
+        data = event["chunk"]["bytes"]
+        if call is not None:
+            call.received(len(data))
+        yield loads(data)
+
+
+def invoke_model_stream(model_id, body, call=None, **kwargs):
+    """Invoke a model with Bedrock's response-stream API and return a ModelStream.
+
+    Pass the object yielded by common.metrics.track_request as call to count bytes and
+    time to first token. Iterate the stream inside the track_request block.
+    """
+    if not isinstance(body, (str, bytes)):
+        body = json.dumps(body)
+    if call is not None:
+        call.sent(len(body))
+    response = get_bedrock_client().invoke_model_with_response_stream(
+        modelId=model_id, body=body, contentType="application/json", **kwargs
+    )
+    return ModelStream(_stream_chunks(response["body"], call), call)
+
+
+class BedrockTransport:
+    """Request signing for the aiohttp Bedrock path.
+
+    The credential provider is resolved once from the shared boto3 session. Each request
+    asks it for frozen credentials, which botocore refreshes before temporary credentials
+    expire (their session token is signed into the request), and a SigV4Auth per service
+    is reused until the credentials change.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._credentials = None
+        self._signers = {}  # service -> (frozen credentials, region, SigV4Auth)
+
+    def _frozen_credentials(self):
+        if self._credentials is None:
+            with self._lock:
+                if self._credentials is None:
+                    credentials = get_session().get_credentials()
+                    if credentials is None:
+                        raise RuntimeError("No AWS credentials found for Bedrock requests.")
+                    self._credentials = credentials
+        return self._credentials.get_frozen_credentials()
+
+    def signer(self, service):
+        frozen = self._frozen_credentials()
+        region = get_region()
+        entry = self._signers.get(service)
+        if entry is None or entry[0] != frozen or entry[1] != region:
+            entry = (frozen, region, SigV4Auth(frozen, service, region))
+            self._signers[service] = entry
+        return entry[2]
+
+    def sign(self, url, data, service, accept="application/json"):
+        """Return the headers for a SigV4-signed JSON POST of data to url."""
+        headers = {"Content-Type": "application/json", "Accept": accept}
+        request = AWSRequest(method="POST", url=url, data=data, headers=headers)
+        self.signer(service).add_auth(request)
+        return dict(request.headers)
+
+
+# Create global transport instance
+transport = BedrockTransport()
+
+
+def create_http_session():
+    """Create an aiohttp session with a pooled, keep-alive connector for Bedrock calls."""
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_CONNECTION_LIMIT,
+        limit_per_host=HTTP_LIMIT_PER_HOST,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+        use_dns_cache=True,
+        ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+    )
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=HTTP_CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+async def signed_post(session, url, body, service="bedrock", call=None):
+    """POST a SigV4-signed JSON request over an aiohttp session and return the parsed body.
+
+    Pass the object yielded by common.metrics.track_request as call to count payload bytes.
+    """
+    data = body if isinstance(body, (str, bytes)) else json.dumps(body)
+    if call is not None:
+        call.sent(len(data))
+    if BEDROCK_MODE in ("record", "replay", "fake"):
+        from common import bedrock_standin
+
+        response_body = await bedrock_standin.signed_post(_signed_post, session, url, data, service)
+        if call is not None:
+            call.received(len(json.dumps(response_body)))
+        return response_body
+    return await _signed_post(session, url, data, service, call)
+
+
+async def _signed_post(session, url, data, service, call=None):
+    headers = transport.sign(url, data, service)
+
+    async with session.post(url, data=data, headers=headers) as response:
+        raw = await response.read()
+        if call is not None:
+            call.received(len(raw))
+        response_body = _timed_loads(raw, call) if raw else {}
+        if response.status >= 400:
+            raise BedrockHTTPError(
+                response.status, response_body, _parse_retry_after(response.headers.get("Retry-After"))
+            )
+        return response_body
+
+
+def signed_post_stream(session, url, body, service="bedrock", call=None):
+    """Streaming counterpart of signed_post for .../invoke-with-response-stream URLs.
+
+    Returns a ModelStream to consume with async for.
+    """
+    data = body if isinstance(body, (str, bytes)) else json.dumps(body)
+    if call is not None:
+        call.sent(len(data))
+    if BEDROCK_MODE in ("record", "replay", "fake"):
+        from common import bedrock_standin
+
+        chunks = bedrock_standin.signed_post_stream(_signed_post_stream, session, url, data, service, call)
+    else:
+        chunks = _signed_post_stream(session, url, data, service, call)
+    return ModelStream(chunks, call)
+
+
+# HTTP status equivalents of exceptions delivered inside a response stream
+_STREAM_EXCEPTION_STATUS = {
+    "throttlingException": 429,
+    "serviceUnavailableException": 503,
+    "validationException": 400,
+    "modelTimeoutException": 408,
+}
+
+
+async def _signed_post_stream(session, url, data, service, call=None):
+    headers = transport.sign(url, data, service, accept="application/vnd.amazon.eventstream")
+
+    async with session.post(url, data=data, headers=headers) as response:
+        if response.status >= 400:
+            raw = await response.read()
+            raise BedrockHTTPError(
+                response.status, loads(raw) if raw else {},
+                _parse_retry_after(response.headers.get("Retry-After")),
+            )
+        buffer = EventStreamBuffer()
+        async for data in response.content.iter_any():
+            if call is not None:
+                call.received(len(data))
+            buffer.add_data(data)
+            for message in buffer:
+                payload = _timed_loads(message.payload, call) if message.payload else {}
+                if message.headers.get(":message-type") == "exception":
+                    exception_type = message.headers.get(":exception-type", "")
+                    raise BedrockHTTPError(
+                        _STREAM_EXCEPTION_STATUS.get(exception_type, 500),
+                        {"message": f"{exception_type}: {payload.get('message')}"},
+                    )
+                if message.headers.get(":event-type") == "chunk":
+                    yield _timed_loads(base64.b64decode(payload["bytes"]), call)
+
+
+def _parse_retry_after(value):
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
@@ -0,0 +1,374 @@
+# bedrock_standin.py
+"""Record/replay stand-in for Bedrock.
+
+Set BEDROCK_MODE to switch every module at once:
+  live   - talk to Bedrock (default)
+  record - talk to Bedrock and save each request/response pair under BEDROCK_FIXTURES_DIR
+  replay - serve saved fixtures without network access
+  fake   - synthesise plausible responses without fixtures or network access (benchmarks)
+
+In replay and fake mode BEDROCK_STANDIN_LATENCY_MS ("250" or "100-400"), BEDROCK_STANDIN_THROTTLE_RATE,
+BEDROCK_STANDIN_ERROR_RATE and BEDROCK_STANDIN_SEED inject latency and failures. Streamed responses
+are delivered in chunks of BEDROCK_FAKE_CHUNK_WORDS words, BEDROCK_STANDIN_CHUNK_MS apart.
+"""
+import asyncio
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import threading
+import time
+
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+from dotenv import load_dotenv
+
+from common.bedrock import BedrockHTTPError
+from common.usage import capture_headers, usage_from_response
+
+load_dotenv()
+
+BEDROCK_MODE = os.getenv("BEDROCK_MODE", "live").lower()
+FIXTURES_DIR = os.getenv("BEDROCK_FIXTURES_DIR", "fixtures/bedrock")
+LATENCY_MS = os.getenv("BEDROCK_STANDIN_LATENCY_MS", "0")
+THROTTLE_RATE = float(os.getenv("BEDROCK_STANDIN_THROTTLE_RATE", "0"))
+ERROR_RATE = float(os.getenv("BEDROCK_STANDIN_ERROR_RATE", "0"))
+SEED = os.getenv("BEDROCK_STANDIN_SEED")
+FAKE_OUTPUT_WORDS = int(os.getenv("BEDROCK_FAKE_OUTPUT_WORDS", "200"))
+FAKE_EMBEDDING_DIMENSION = 1536
+FAKE_CHUNK_WORDS = int(os.getenv("BEDROCK_FAKE_CHUNK_WORDS", "8"))
+CHUNK_MS = os.getenv("BEDROCK_STANDIN_CHUNK_MS", "0")
+
+# Request bodies larger than this (page images) are stored as a hash only
+MAX_STORED_REQUEST_BYTES = 64 * 1024
+
+_random = random.Random(int(SEED) if SEED else None)
+_random_lock = threading.Lock()
+
+
+class FixtureNotFoundError(KeyError):
+    pass
+
+
+def _as_bytes(body):
+    if isinstance(body, (bytes, bytearray)):
+        return bytes(body)
+    if isinstance(body, str):
+        return body.encode("utf-8")
+    return json.dumps(body).encode("utf-8")
+
+
+def _target_from_url(url):
+    # Drop scheme, host and region so fixtures are portable between regions
+    return re.sub(r"^https?://[^/]+", "", url)
+
+
+def fixture_key(operation, target, body):
+    digest = hashlib.sha256()
+    digest.update(f"{operation}\n{target}\n".encode("utf-8"))
+    digest.update(_as_bytes(body))
+    return digest.hexdigest()
+
+
+def _fixture_path(key):
+    return os.path.join(FIXTURES_DIR, key[:2], f"{key}.json")
+
+
+def save_fixture(operation, target, body, response, headers=None):
+    body_bytes = _as_bytes(body)
+    key = fixture_key(operation, target, body_bytes)
+    fixture = {
+        "operation": operation,
+        "target": target,
+        "request_sha256": hashlib.sha256(body_bytes).hexdigest(),
+        "request": body_bytes.decode("utf-8", "replace") if len(body_bytes) <= MAX_STORED_REQUEST_BYTES else None,
+        "response": response,
+        "headers": headers or {},
+    }
+    path = _fixture_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + ".temp"
+    with open(temp_path, "w") as f:
+        json.dump(fixture, f, indent=2)
+    os.replace(temp_path, path)
+
+
+def load_fixture(operation, target, body):
+    key = fixture_key(operation, target, body)
+    path = _fixture_path(key)
+    if not os.path.exists(path):
+        raise FixtureNotFoundError(
+            f"No Bedrock fixture for {operation} {target} ({key}). Run once with BEDROCK_MODE=record."
+        )
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _prompt_text(request):
+    if "prompt" in request:
+        return request["prompt"]
+    if "inputText" in request:
+        return request["inputText"]
+    parts = []
+    for message in request.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+            continue
+        for block in content or []:
+            if block.get("type") == "text":
+                parts.append(block["text"])
+    return "\n".join(parts)
+
+
+def fake_response(target, body):
+    """Synthesise a deterministic response shaped like the model behind target."""
+    body_bytes = _as_bytes(body)
+    rng = random.Random(hashlib.sha256(body_bytes).hexdigest())
+    try:
+        request = json.loads(body_bytes)
+    except ValueError:
+        request = {}
+
+    if "/guardrails/" in target:
+        return {"results": [{"evaluation": "PASS"}]}
+    if "titan-embed" in target:
+        return {
+            "embedding": [rng.gauss(0, 1) for _ in range(FAKE_EMBEDDING_DIMENSION)],
+            "inputTextTokenCount": len(request.get("inputText", "").split()),
+        }
+
+    prompt = _prompt_text(request)
+    words = ["requirement", "system", "user", "verify", "valid", "input", "page", "result"]
+    text = " ".join(rng.choice(words) for _ in range(FAKE_OUTPUT_WORDS))
+    batch = re.search(r"contains pages ([\d, ]+) of the PDF", prompt)
+    if batch:
+        # Multi-page BRD request: one delimited analysis per page
+        text = "\n\n".join(
+            f"=== Page {page_num} ===\n" + " ".join(rng.choice(words) for _ in range(FAKE_OUTPUT_WORDS))
+            for page_num in batch.group(1).split(", ")
+        )
+    if "JSON" in prompt:
+        text = json.dumps({"Matched Percentage": f"{rng.uniform(0, 100):.2f}%", "Reason": text})
+
+    if "mistral" in target:
+        return {"outputs": [{"text": text, "stop_reason": "stop"}]}
+    return {
+        "content": [{"type": "text", "text": text}],
+        "stop_reason": "end_turn",
+        "usage": {"input_tokens": len(body_bytes) // 4, "output_tokens": FAKE_OUTPUT_WORDS},
+    }
+
+
+def fake_stream_chunks(target, response):
+    """Split a complete response into the chunk sequence Bedrock would stream for it."""
+    if "mistral" in target:
+        text = response["outputs"][0]["text"]
+    else:
+        text = response["content"][0]["text"]
+    words = text.split(" ")
+    pieces = [
+        " ".join(words[i:i + FAKE_CHUNK_WORDS]) + (" " if i + FAKE_CHUNK_WORDS < len(words) else "")
+        for i in range(0, len(words), FAKE_CHUNK_WORDS)
+    ]
+    usage = response.get("usage", {"input_tokens": 0, "output_tokens": len(words)})
+    invocation_metrics = {
+        "inputTokenCount": usage["input_tokens"],
+        "outputTokenCount": usage["output_tokens"],
+    }
+
+    if "mistral" in target:
+        chunks = [{"outputs": [{"text": piece, "stop_reason": None}]} for piece in pieces]
+        chunks.append({
+            "outputs": [{"text": "", "stop_reason": "stop"}],
+            "amazon-bedrock-invocationMetrics": invocation_metrics,
+        })
+        return chunks
+    chunks = [
+        {"type": "message_start", "message": {"role": "assistant", "usage": {"input_tokens": usage["input_tokens"]}}},
+        {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}},
+    ]
+    chunks.extend(
+        {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": piece}}
+        for piece in pieces
+    )
+    chunks.extend([
+        {"type": "content_block_stop", "index": 0},
+        {"type": "message_delta", "delta": {"stop_reason": "end_turn"}, "usage": {"output_tokens": usage["output_tokens"]}},
+        {"type": "message_stop", "amazon-bedrock-invocationMetrics": invocation_metrics},
+    ])
+    return chunks
+
+
+def _latency_seconds(spec=None):
+    low, _, high = (spec or LATENCY_MS).partition("-")
+    low = float(low or 0)
+    high = float(high) if high else low
+    with _random_lock:
+        return _random.uniform(low, high) / 1000.0
+
+
+def _draw_fault():
+    """Return "throttle", "error" or None according to the configured rates."""
+    with _random_lock:
+        draw = _random.random()
+    if draw < THROTTLE_RATE:
+        return "throttle"
+    if draw < THROTTLE_RATE + ERROR_RATE:
+        return "error"
+    return None
+
+
+def _raise_client_fault(fault, operation):
+    if fault == "throttle":
+        raise ClientError(
+            {
+                "Error": {"Code": "ThrottlingException", "Message": "Rate exceeded (stand-in)"},
+                "ResponseMetadata": {"HTTPStatusCode": 429, "HTTPHeaders": {"retry-after": "1"}},
+            },
+            operation,
+        )
+    if fault == "error":
+        raise ClientError(
+            {
+                "Error": {"Code": "ServiceUnavailableException", "Message": "Injected failure (stand-in)"},
+                "ResponseMetadata": {"HTTPStatusCode": 503},
+            },
+            operation,
+        )
+
+
+def _raise_http_fault(fault):
+    if fault == "throttle":
+        raise BedrockHTTPError(429, {"message": "ThrottlingException: Rate exceeded (stand-in)"}, retry_after=1.0)
+    if fault == "error":
+        raise BedrockHTTPError(503, {"message": "ServiceUnavailableException: Injected failure (stand-in)"})
+
+
+def _fake_usage_headers(body, response):
+    usage = usage_from_response(body=response) or (len(_as_bytes(body)) // 4, FAKE_OUTPUT_WORDS)
+    return {
+        "x-amzn-bedrock-input-token-count": str(usage[0]),
+        "x-amzn-bedrock-output-token-count": str(usage[1]),
+    }
+
+
+def _streaming_body(payload):
+    data = json.dumps(payload).encode("utf-8")
+    return StreamingBody(io.BytesIO(data), len(data))
+
+
+def _stream_events(chunks):
+    for i, chunk in enumerate(chunks):
+        if i:
+            time.sleep(_latency_seconds(CHUNK_MS))
+        yield {"chunk": {"bytes": json.dumps(chunk).encode("utf-8")}}
+
+
+def _recording_events(events, body, target):
+    chunks = []
+    for event in events:
+        if "chunk" in event:
+            chunks.append(json.loads(event["chunk"]["bytes"]))
+        yield event
+    save_fixture("InvokeModelWithResponseStream", target, body, {"chunks": chunks})
+
+
+class StandInBedrockClient:
+    """Drop-in for a boto3 bedrock-runtime client that records or replays invoke_model calls."""
+
+    def __init__(self, client=None, mode=BEDROCK_MODE):
+        self._client = client
+        self.mode = mode
+
+    def invoke_model(self, modelId, body, **kwargs):
+        target = f"/model/{modelId}/invoke"
+        if self.mode == "record":
+            response = self._client.invoke_model(modelId=modelId, body=body, **kwargs)
+            payload = json.loads(response["body"].read())
+            headers = response.get("ResponseMetadata", {}).get("HTTPHeaders", {})
+            save_fixture("InvokeModel", target, body, payload, headers)
+            response["body"] = _streaming_body(payload)
+            return response
+
+        if self.mode == "fake":
+            fixture = {"response": fake_response(target, body)}
+            fixture["headers"] = _fake_usage_headers(body, fixture["response"])
+        else:
+            fixture = load_fixture("InvokeModel", target, body)
+        time.sleep(_latency_seconds())
+        _raise_client_fault(_draw_fault(), "InvokeModel")
+        capture_headers(fixture.get("headers", {}))
+        return {
+            "body": _streaming_body(fixture["response"]),
+            "contentType": "application/json",
+            "ResponseMetadata": {"HTTPStatusCode": 200, "HTTPHeaders": fixture.get("headers", {})},
+        }
+
+    def invoke_model_with_response_stream(self, modelId, body, **kwargs):
+        target = f"/model/{modelId}/invoke-with-response-stream"
+        if self.mode == "record":
+            response = self._client.invoke_model_with_response_stream(modelId=modelId, body=body, **kwargs)
+            response["body"] = _recording_events(response["body"], body, target)
+            return response
+
+        if self.mode == "fake":
+            chunks = fake_stream_chunks(target, fake_response(target, body))
+        else:
+            chunks = load_fixture("InvokeModelWithResponseStream", target, body)["response"]["chunks"]
+        time.sleep(_latency_seconds())
+        _raise_client_fault(_draw_fault(), "InvokeModelWithResponseStream")
+        return {
+            "body": _stream_events(chunks),
+            "contentType": "application/vnd.amazon.eventstream",
+            "ResponseMetadata": {"HTTPStatusCode": 200, "HTTPHeaders": {}},
+        }
+
+    def __getattr__(self, name):
+        if self._client is None:
+            raise AttributeError(f"{name} is not available on the replay stand-in")
+        return getattr(self._client, name)
+
+
+async def signed_post(live_post, session, url, body, service):
+    """Record or replay one SigV4 POST made through common.bedrock.signed_post."""
+    target = _target_from_url(url)
+    if BEDROCK_MODE == "record":
+        response = await live_post(session, url, body, service)
+        save_fixture("POST", target, body, response)
+        return response
+
+    if BEDROCK_MODE == "fake":
+        response = fake_response(target, body)
+    else:
+        response = load_fixture("POST", target, body)["response"]
+    await asyncio.sleep(_latency_seconds())
+    _raise_http_fault(_draw_fault())
+    return response
+
+
+async def signed_post_stream(live_stream, session, url, body, service, call=None):
+    """Record or replay the chunks of one streamed SigV4 POST (common.bedrock.signed_post_stream)."""
+    target = _target_from_url(url)
+    if BEDROCK_MODE == "record":
+        chunks = []
+        async for chunk in live_stream(session, url, body, service, call):
+            chunks.append(chunk)
+            yield chunk
+        save_fixture("POST", target, body, {"chunks": chunks})
+        return
+
+    if BEDROCK_MODE == "fake":
+        chunks = fake_stream_chunks(target, fake_response(target, body))
+    else:
+        chunks = load_fixture("POST", target, body)["response"]["chunks"]
+    await asyncio.sleep(_latency_seconds())
+    _raise_http_fault(_draw_fault())
+    for i, chunk in enumerate(chunks):
+        if i:
+            await asyncio.sleep(_latency_seconds(CHUNK_MS))
+        if call is not None:
+            call.received(len(json.dumps(chunk)))
+        yield chunk
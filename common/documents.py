@@ -0,0 +1,271 @@
+# documents.py
+import hashlib
+import io
+import mmap
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+import fitz
+from dotenv import load_dotenv
+
+from common.metrics import app_metrics, track_stage
+
+load_dotenv()
+
+DOCUMENT_CACHE_DIR = os.getenv("DOCUMENT_CACHE_DIR", ".cache/documents")
+DOCUMENT_CACHE_MAX_BYTES = int(os.getenv("DOCUMENT_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+# Parsed documents kept open in memory
+DOCUMENT_OPEN_DOCS = int(os.getenv("DOCUMENT_OPEN_DOCS", "8"))
+# Resolution of the thumbnail behind page fingerprints
+FINGERPRINT_DPI = 24
+IMAGE_FORMATS = {"png": "png", "jpeg": "jpg", "jpg": "jpg", "webp": "webp"}
+# A header or footer line holding nothing but the page number ("7", "Page 7", "7 of 20", "- 7 -")
+PAGE_NUMBER_LINE = re.compile(r"^[-\s]*(page\s*)?\d+(\s*(of|/)\s*\d+)?[-\s]*$", re.IGNORECASE)
+
+
+def document_id(pdf_bytes):
+    """Content address of a document: the sha256 of its bytes."""
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+
+def _read_bytes(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source)
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            return f.read()
+    # File-like objects such as Streamlit's UploadedFile
+    if hasattr(source, "getvalue"):
+        return source.getvalue()
+    source.seek(0)
+    return source.read()
+
+
+def _read_cached(path):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return mapped[:]
+
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class DocumentService:
+    """Content-addressed PDF store shared by all apps.
+
+    Documents are identified by the hash of their bytes; rendered pages (per DPI and
+    format) and extracted text are produced on first request and kept on disk, so the
+    same file uploaded again, or opened by another app, is not parsed or rasterised twice.
+    """
+
+    def __init__(self, cache_dir=DOCUMENT_CACHE_DIR, max_bytes=DOCUMENT_CACHE_MAX_BYTES,
+                 open_docs=DOCUMENT_OPEN_DOCS):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.open_docs = open_docs
+        self._docs = OrderedDict()
+        # MuPDF documents must not be used from two threads at once
+        self._lock = threading.RLock()
+
+    def _doc_dir(self, doc_id):
+        return os.path.join(self.cache_dir, doc_id[:2], doc_id)
+
+    def register(self, source):
+        """Store a PDF (bytes, path or file-like object) and return its document id."""
+        pdf_bytes = _read_bytes(source)
+        doc_id = document_id(pdf_bytes)
+        doc_dir = self._doc_dir(doc_id)
+        source_path = os.path.join(doc_dir, "source.pdf")
+        if os.path.exists(source_path):
+            os.utime(doc_dir)
+        else:
+            os.makedirs(doc_dir, exist_ok=True)
+            _write_atomic(source_path, pdf_bytes)
+            self._evict()
+        with self._lock:
+            if doc_id not in self._docs:
+                # Parse the bytes already in memory rather than reading the stored file back
+                self._keep_open(doc_id, fitz.open(stream=pdf_bytes, filetype="pdf"))
+        return doc_id
+
+    def _keep_open(self, doc_id, document):
+        self._docs[doc_id] = document
+        while len(self._docs) > self.open_docs:
+            _, oldest = self._docs.popitem(last=False)
+            oldest.close()
+
+    def _open(self, doc_id):
+        document = self._docs.get(doc_id)
+        if document is None:
+            source_path = os.path.join(self._doc_dir(doc_id), "source.pdf")
+            if not os.path.exists(source_path):
+                raise KeyError(f"Unknown document {doc_id}")
+            document = fitz.open(source_path)
+            self._keep_open(doc_id, document)
+        self._docs.move_to_end(doc_id)
+        return document
+
+    def page_count(self, doc_id):
+        with self._lock:
+            return len(self._open(doc_id))
+
+    def _cached(self, doc_id, name, produce):
+        path = os.path.join(self._doc_dir(doc_id), name)
+        if os.path.exists(path):
+            app_metrics.cache_requests.labels("documents", "hit").inc()
+            return _read_cached(path)
+        app_metrics.cache_requests.labels("documents", "miss").inc()
+        data = produce()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _write_atomic(path, data)
+        return data
+
+    def page_info(self, doc_id, page_index):
+        """Describe a page's layout without rendering it.
+
+        Returns its size in points, whether it embeds raster images, the number of vector
+        drawings, the text layer length and the fraction of the page covered by text blocks.
+        """
+        with self._lock:
+            page = self._open(doc_id).load_page(page_index)
+            blocks = [block for block in page.get_text("blocks") if block[6] == 0]
+            text_area = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1, *_ in blocks)
+            return {
+                "width": page.rect.width,
+                "height": page.rect.height,
+                "images": bool(page.get_images()),
+                "drawings": len(page.get_cdrawings()),
+                "text_chars": sum(len(block[4].strip()) for block in blocks),
+                "text_coverage": text_area / page.rect.get_area() if page.rect.get_area() else 0.0,
+            }
+
+    def page_table_count(self, doc_id, page_index):
+        """Return the number of tables MuPDF detects on a page (slower than page_info)."""
+        with self._lock:
+            return len(self._open(doc_id).load_page(page_index).find_tables().tables)
+
+    def render_page(self, doc_id, page_index, dpi=72, fmt="png", quality=85, grayscale=False):
+        """Return page page_index (0-based) rendered at dpi as PNG, JPEG or WebP bytes."""
+        extension = IMAGE_FORMATS[fmt.lower()]
+        name = f"page-{page_index}-{dpi}"
+        if grayscale:
+            name += "-gray"
+        if extension != "png":
+            name += f"-q{quality}"
+        name += f".{extension}"
+
+        def produce():
+            with self._lock, track_stage("documents", "render_page", page=page_index + 1, dpi=dpi):
+                colorspace = fitz.csGRAY if grayscale else fitz.csRGB
+                pix = self._open(doc_id).load_page(page_index).get_pixmap(dpi=dpi, colorspace=colorspace)
+                if extension == "png":
+                    return pix.tobytes("png")
+                if extension == "jpg":
+                    return pix.tobytes("jpg", jpg_quality=quality)
+                size, samples = (pix.width, pix.height), pix.samples
+            # MuPDF has no WebP writer
+            from PIL import Image
+
+            image = Image.frombytes("L" if grayscale else "RGB", size, samples)
+            output = io.BytesIO()
+            image.save(output, "WEBP", quality=quality)
+            return output.getvalue()
+
+        return self._cached(doc_id, name, produce)
+
+    def page_image(self, doc_id, page_index, dpi=72):
+        """Return the rendered page as a PIL image."""
+        from PIL import Image
+
+        return Image.open(io.BytesIO(self.render_page(doc_id, page_index, dpi=dpi)))
+
+    def page_text(self, doc_id, page_index):
+        """Return the text layer of page page_index (0-based)."""
+        def produce():
+            with self._lock, track_stage("documents", "extract_text", page=page_index + 1):
+                return self._open(doc_id).load_page(page_index).get_text().encode("utf-8")
+
+        return self._cached(doc_id, f"page-{page_index}.txt", produce).decode("utf-8")
+
+    def page_fingerprint(self, doc_id, page_index, hash_size=16):
+        """Return (dhash, text_hash) for spotting duplicate pages within or across documents.
+
+        dhash is a hash_size**2-bit difference hash of a grayscale thumbnail; text_hash is the
+        sha256 of the page text with case and whitespace normalised and a page-number header
+        or footer line removed. Any other difference in the text, such as a requirement id or
+        an amount, gives a different text_hash.
+        """
+        from PIL import Image
+
+        thumbnail = self.render_page(doc_id, page_index, dpi=FINGERPRINT_DPI, grayscale=True)
+        image = Image.open(io.BytesIO(thumbnail)).convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+        pixels = image.tobytes()
+        dhash = 0
+        for row in range(hash_size):
+            offset = row * (hash_size + 1)
+            for col in range(hash_size):
+                dhash = (dhash << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+        lines = [line for line in self.page_text(doc_id, page_index).splitlines() if line.strip()]
+        if lines and PAGE_NUMBER_LINE.match(lines[-1]):
+            lines.pop()
+        elif lines and PAGE_NUMBER_LINE.match(lines[0]):
+            lines.pop(0)
+        text = " ".join(" ".join(lines).lower().split())
+        return dhash, hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def text(self, doc_id):
+        """Return the text of all pages, separated by blank lines."""
+        return "\n\n".join(self.page_text(doc_id, n) for n in range(self.page_count(doc_id)))
+
+    def _evict(self):
+        """Delete least recently registered documents until the cache fits max_bytes."""
+        entries = []
+        total = 0
+        for root, dirs, files in os.walk(self.cache_dir):
+            if "source.pdf" not in files:
+                continue
+            size = sum(os.path.getsize(os.path.join(root, name)) for name in files)
+            entries.append((os.path.getmtime(root), size, root))
+            total += size
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        with self._lock:
+            for _, size, root in entries:
+                if total <= self.max_bytes * 0.9:
+                    break
+                doc_id = os.path.basename(root)
+                document = self._docs.pop(doc_id, None)
+                if document is not None:
+                    document.close()
+                shutil.rmtree(root, ignore_errors=True)
+                total -= size
+
+
+# Create global document service instance
+documents = DocumentService()
+
+_worker_services = {}
+
+
+def render_page_to_cache(cache_dir, doc_id, page_index, dpi=72, fmt="png", quality=85, grayscale=False):
+    """Process-pool entry point: render a page into the on-disk cache and return the seconds spent.
+
+    The caller then reads the page with render_page(), which is a cache hit.
+    """
+    service = _worker_services.get(cache_dir)
+    if service is None:
+        service = _worker_services[cache_dir] = DocumentService(cache_dir)
+    start_time = time.perf_counter()
+    service.render_page(doc_id, page_index, dpi, fmt, quality, grayscale)
+    return time.perf_counter() - start_time
@@ -0,0 +1,259 @@
+# jobs.py
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing.managers import SyncManager
+
+from dotenv import load_dotenv
+
+from common.scheduler import FairScheduler, scheduler
+from common.usage import TokenBudget, budget, current_tenant, tenant_scope, usage_tracker
+
+load_dotenv()
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_THREAD_WORKERS = int(os.getenv("JOB_THREAD_WORKERS", "4"))
+# Finished jobs are forgotten after this many seconds if nobody collects them
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class _BrokerManager(SyncManager):
+    """Manager process that also serves the model-call limits shared with job workers."""
+
+
+_BrokerManager.register("TokenBudget", TokenBudget, exposed=("try_reserve", "settle", "release", "remaining"))
+_BrokerManager.register("FairScheduler", FairScheduler, exposed=("acquire", "release"))
+
+
+class JobContext:
+    """Handle passed to job functions for progress reporting and cooperative cancellation."""
+
+    def __init__(self, job_id, state, updates):
+        self.job_id = job_id
+        self._state = state
+        self._updates = updates
+
+    def cancelled(self):
+        return bool(self._state.get(self.job_id, {}).get("cancel_requested"))
+
+    def check_cancelled(self):
+        if self.cancelled():
+            raise JobCancelled(f"Job {self.job_id} was cancelled")
+
+    def progress(self, done, total=None, message=None, partial=None):
+        """Report progress (done=None keeps the count); partials are delivered in order."""
+        self._updates.put((done, total, message, partial))
+        self.check_cancelled()
+
+
+def _run_job(fn, job_id, state, updates, tenant, args, kwargs):
+    entry = dict(state[job_id])
+    entry["status"] = "running"
+    entry["started"] = time.time()
+    state[job_id] = entry
+    with tenant_scope(tenant):
+        return fn(JobContext(job_id, state, updates), *args, **kwargs)
+
+
+def _run_process_job(fn, job_id, state, updates, tenant, shared_budget, shared_scheduler, args, kwargs):
+    # Model calls in the worker draw from the same token budget and slots as the app process
+    budget.attach(shared_budget)
+    scheduler.attach(shared_scheduler)
+    # Model usage recorded in the worker is shipped back so the session totals stay complete
+    before = usage_tracker.for_tenant(tenant)
+    result = _run_job(fn, job_id, state, updates, tenant, args, kwargs)
+    after = usage_tracker.for_tenant(tenant)
+    usage = {
+        app: {key: value - before.get(app, {}).get(key, 0) for key, value in totals.items()}
+        for app, totals in after.items()
+    }
+    return result, usage
+
+
+class JobManager:
+    """Runs heavy work off the Streamlit script thread and lets reruns poll for it."""
+
+    def __init__(self, max_workers=JOB_WORKERS, max_thread_workers=JOB_THREAD_WORKERS):
+        context = multiprocessing.get_context("spawn")
+        self._mp_manager = _BrokerManager(ctx=context)
+        self._mp_manager.start()
+        self._state = self._mp_manager.dict()
+        # One token budget and one model-call gate for this process and every job worker,
+        # served by the manager process
+        self._budget = self._mp_manager.TokenBudget(budget.tokens_per_minute)
+        budget.attach(self._budget)
+        self._scheduler = self._mp_manager.FairScheduler(scheduler.max_concurrency)
+        scheduler.attach(self._scheduler)
+        self._processes = ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+        self._threads = ThreadPoolExecutor(max_workers=max_thread_workers, thread_name_prefix="job")
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def submit(self, fn, *args, kind="process", label=None, **kwargs):
+        """Submit fn(job, *args, **kwargs) and return a job id.
+
+        kind="process" runs in the process pool (fn and arguments must be picklable);
+        kind="thread" is for work holding unpicklable state, such as a loaded model.
+        """
+        job_id = uuid.uuid4().hex
+        updates = self._mp_manager.Queue()
+        self._state[job_id] = {"status": "pending", "cancel_requested": False}
+        tenant = current_tenant()
+        if kind == "process":
+            future = self._processes.submit(
+                _run_process_job, fn, job_id, self._state, updates, tenant,
+                self._budget, self._scheduler, args, kwargs,
+            )
+            future.add_done_callback(lambda f: self._merge_usage(tenant, f))
+        else:
+            future = self._threads.submit(_run_job, fn, job_id, self._state, updates, tenant, args, kwargs)
+        with self._lock:
+            self._forget_expired()
+            self._jobs[job_id] = {
+                "future": future,
+                "updates": updates,
+                "label": label or getattr(fn, "__name__", "job"),
+                "submitted": time.time(),
+                "done": 0,
+                "total": None,
+                "message": None,
+                "partials": [],
+                "kind": kind,
+            }
+        return job_id
+
+    @staticmethod
+    def _merge_usage(tenant, future):
+        if not future.cancelled() and future.exception() is None:
+            usage_tracker.merge(tenant, future.result()[1])
+
+    def _drain(self, job):
+        while True:
+            try:
+                done, total, message, partial = job["updates"].get_nowait()
+            except queue.Empty:
+                break
+            job["done"] = done if done is not None else job["done"]
+            job["total"] = total if total is not None else job["total"]
+            job["message"] = message if message is not None else job["message"]
+            if partial is not None:
+                job["partials"].append(partial)
+
+    def status(self, job_id):
+        """Return a snapshot: status, done, total, message, partials and error."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return {"status": "unknown"}
+            self._drain(job)
+            future = job["future"]
+            state = self._state.get(job_id, {})
+            if future.cancelled():
+                status = "cancelled"
+            elif future.done():
+                error = future.exception()
+                if error is None:
+                    status = "done"
+                elif isinstance(error, JobCancelled):
+                    status = "cancelled"
+                else:
+                    status = "failed"
+            else:
+                status = state.get("status", "pending")
+            if not future.done() and state.get("cancel_requested"):
+                status = "cancelling"
+
+            snapshot = {
+                "status": status,
+                "label": job["label"],
+                "done": job["done"],
+                "total": job["total"],
+                "message": job["message"],
+                "partials": list(job["partials"]),
+                "elapsed": time.time() - job["submitted"],
+                "error": None,
+            }
+            if status == "failed":
+                error = future.exception()
+                snapshot["error"] = "".join(traceback.format_exception_only(type(error), error)).strip()
+            return snapshot
+
+    def result(self, job_id):
+        """Return the job's result (raises the job's exception if it failed)."""
+        with self._lock:
+            job = self._jobs[job_id]
+        result = job["future"].result()
+        return result[0] if job["kind"] == "process" else result
+
+    def cancel(self, job_id):
+        """Cancel a pending job, or ask a running one to stop at its next progress report."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            if not job["future"].cancel():
+                entry = dict(self._state.get(job_id, {}))
+                entry["cancel_requested"] = True
+                self._state[job_id] = entry
+
+    def forget(self, job_id):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+            self._state.pop(job_id, None)
+
+    def _forget_expired(self):
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job["future"].done() and now - job["submitted"] > JOB_RETENTION_SECONDS:
+                self._jobs.pop(job_id, None)
+                self._state.pop(job_id, None)
+
+
+_job_manager = None
+_job_manager_lock = threading.Lock()
+
+
+def get_job_manager():
+    """Return the process-wide job manager, created on first use."""
+    global _job_manager
+    if _job_manager is None:
+        with _job_manager_lock:
+            if _job_manager is None:
+                _job_manager = JobManager()
+    return _job_manager
+
+
+def poll_job(job_id, label="Working...", poll_interval=1.0, on_progress=None):
+    """Render progress and a cancel button for a job in Streamlit.
+
+    While the job is active this schedules another rerun, so the script thread is never
+    blocked on the job itself; on_progress(status) can render partial results first.
+    Returns the final status snapshot once the job has finished.
+    """
+    import streamlit as st
+
+    manager = get_job_manager()
+    status = manager.status(job_id)
+    if status["status"] in ("pending", "running", "cancelling"):
+        total = status["total"]
+        fraction = min(1.0, status["done"] / total) if total else 0.0
+        text = status["message"] or label
+        if total:
+            text = f"{text} ({status['done']}/{total})"
+        st.progress(fraction, text=text)
+        if st.button("Cancel", key=f"cancel_{job_id}"):
+            manager.cancel(job_id)
+        if on_progress is not None:
+            on_progress(status)
+        time.sleep(poll_interval)
+        st.rerun()
+    return status
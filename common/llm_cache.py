@@ -0,0 +1,160 @@
+# llm_cache.py
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from dotenv import load_dotenv
+
+from common.metrics import app_metrics
+
+load_dotenv()
+
+CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+CACHE_DIR = os.getenv("LLM_CACHE_DIR", ".cache/llm")
+CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+CACHE_MEMORY_ITEMS = int(os.getenv("LLM_CACHE_MEMORY_ITEMS", "256"))
+CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+
+
+def make_key(model_id, params, payload):
+    """Hash the model id, parameters and full request payload (including image bytes)."""
+    digest = hashlib.sha256()
+    digest.update(json.dumps({"model_id": model_id, "params": params}, sort_keys=True).encode("utf-8"))
+    if isinstance(payload, (bytes, bytearray, memoryview)):
+        digest.update(payload)
+    elif isinstance(payload, str):
+        digest.update(payload.encode("utf-8"))
+    else:
+        digest.update(json.dumps(payload, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class LLMCache:
+    """Two-tier response cache: an in-memory LRU in front of a size-bounded SQLite file."""
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES,
+                 memory_items=CACHE_MEMORY_ITEMS, ttl=CACHE_TTL, enabled=CACHE_ENABLED):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self.ttl = ttl
+        self.enabled = enabled
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._conn = sqlite3.connect(
+                os.path.join(self.cache_dir, "responses.sqlite3"), check_same_thread=False
+            )
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, app TEXT, value TEXT, size INTEGER, "
+                "expires REAL, accessed REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        return self._conn
+
+    def _remember(self, key, expires, value):
+        self._memory[key] = (expires, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get(self, app, key):
+        """Return the cached value for key, or None on a miss."""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[0] > now:
+                self._memory.move_to_end(key)
+                self._count(app, "hit")
+                return entry[1]
+            self._memory.pop(key, None)
+
+            try:
+                conn = self._connect()
+                row = conn.execute(
+                    "SELECT value, expires FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and row[1] > now:
+                    conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+                    conn.commit()
+                    value = json.loads(row[0])
+                    self._remember(key, row[1], value)
+                    self._count(app, "hit")
+                    return value
+                if row is not None:
+                    conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    conn.commit()
+            except sqlite3.Error as e:
+                print(f"LLM cache read failed: {e}")
+
+            self._count(app, "miss")
+            return None
+
+    def _count(self, app, result):
+        if result == "hit":
+            self.hits[app] += 1
+        else:
+            self.misses[app] += 1
+        app_metrics.cache_requests.labels(app, result).inc()
+
+    def set(self, app, key, value, ttl=None):
+        """Store a JSON-serialisable value under key in both tiers."""
+        if not self.enabled:
+            return
+        now = time.time()
+        expires = now + (ttl if ttl is not None else self.ttl)
+        serialized = json.dumps(value)
+        with self._lock:
+            self._remember(key, expires, value)
+            try:
+                conn = self._connect()
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, app, value, size, expires, accessed) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, app, serialized, len(serialized), expires, now),
+                )
+                self._evict(conn, now)
+                conn.commit()
+            except sqlite3.Error as e:
+                print(f"LLM cache write failed: {e}")
+
+    def _evict(self, conn, now):
+        conn.execute("DELETE FROM entries WHERE expires <= ?", (now,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Drop least recently used entries until we are back under 90% of the limit
+        target = total - int(self.max_bytes * 0.9)
+        freed = 0
+        stale = []
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed"):
+            stale.append((key,))
+            freed += size
+            if freed >= target:
+                break
+        conn.executemany("DELETE FROM entries WHERE key = ?", stale)
+        for (key,) in stale:
+            self._memory.pop(key, None)
+
+    def stats(self):
+        """Return hit/miss counters per app."""
+        apps = set(self.hits) | set(self.misses)
+        return {app: {"hits": self.hits[app], "misses": self.misses[app]} for app in sorted(apps)}
+
+
+# Create global cache instance
+llm_cache = LLMCache()
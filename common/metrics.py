@@ -0,0 +1,194 @@
+# metrics.py
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import aiohttp
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv
+# PROMETHEUS_MULTIPROC_DIR is set up by the common package before this import (see
+# common/__init__.py); modules outside common take the metric classes from here
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, multiprocess, start_http_server
+
+import common
+from common.tracing import span
+
+load_dotenv()
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "8000"))
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+_lock = threading.Lock()
+# name -> collector, the only record of what this process registered. It is kept on the
+# common package so a re-import of this module (Streamlit reloads edited files) reuses
+# the collectors instead of registering the same names twice.
+_collectors = common.__dict__.setdefault("_metric_collectors", {})
+_exporter_started = False
+
+
+def get_or_create(metric_cls, name, documentation, labelnames=(), **kwargs):
+    """Return the collector registered under name, creating it once per process."""
+    with _lock:
+        collector = _collectors.get(name)
+        if collector is None:
+            collector = _collectors[name] = metric_cls(name, documentation, labelnames, **kwargs)
+    return collector
+
+
+def start_exporter(port=METRICS_PORT):
+    """Start the /metrics HTTP exporter once per process."""
+    global _exporter_started
+    with _lock:
+        if _exporter_started:
+            return
+        _exporter_started = True
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # Aggregate samples written by job and render worker processes as well
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    try:
+        start_http_server(port, registry=registry)
+        print(f"Prometheus metrics exposed on http://localhost:{port}/metrics")
+    except OSError as e:
+        # Another worker on this host already owns the port
+        print(f"Metrics exporter not started on port {port}: {e}")
+
+
+def error_cause(exc):
+    """Map an exception to a small, fixed set of cause labels."""
+    if isinstance(exc, ClientError):
+        code = exc.response.get("Error", {}).get("Code", "")
+        status = exc.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+        if "Throttl" in code or status == 429:
+            return "throttled"
+        if status == 408:
+            return "timeout"
+        return "server_error" if status >= 500 else "client_error"
+    status = getattr(exc, "status", None)
+    if isinstance(status, int):
+        if status == 429:
+            return "throttled"
+        if status == 408:
+            return "timeout"
+        return "server_error" if status >= 500 else "client_error"
+    name = type(exc).__name__
+    if isinstance(exc, TimeoutError) or "Timeout" in name:
+        return "timeout"
+    # A pooled keep-alive connection the server already closed fails as one of these
+    if isinstance(exc, (ConnectionError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError)) \
+            or "Connect" in name:
+        return "connection"
+    return "other"
+
+
+class SharedMetrics:
+    _instance = None
+    _initialized = False
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(SharedMetrics, cls).__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if not self._initialized:
+            self.request_latency = get_or_create(
+                Histogram, "genai_model_request_seconds", "Latency of model calls",
+                ["app", "model", "outcome"], buckets=LATENCY_BUCKETS,
+            )
+            self.stage_latency = get_or_create(
+                Histogram, "genai_stage_seconds", "Latency of non-model processing stages",
+                ["app", "stage"], buckets=STAGE_BUCKETS,
+            )
+            self.in_flight = get_or_create(
+                Gauge, "genai_requests_in_flight", "Model calls currently in flight", ["app"]
+            )
+            self.errors = get_or_create(
+                Counter, "genai_errors_total", "Errors by cause", ["app", "cause"]
+            )
+            self.bytes = get_or_create(
+                Counter, "genai_model_bytes_total", "Bytes sent to and received from models",
+                ["app", "direction"],
+            )
+            self.first_token_latency = get_or_create(
+                Histogram, "genai_time_to_first_token_seconds", "Time until a streamed call yields text",
+                ["app", "model"], buckets=LATENCY_BUCKETS,
+            )
+            self.cache_requests = get_or_create(
+                Counter, "genai_llm_cache_requests_total", "LLM response cache lookups",
+                ["app", "result"],
+            )
+            self._initialized = True
+
+
+# Create global metrics instance
+app_metrics = SharedMetrics()
+
+
+class _Call:
+    def __init__(self, app, model_id=None):
+        self.app = app
+        self.model_id = model_id
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.start_time = time.perf_counter()
+        self.first_token_seconds = None
+        # Time spent decoding response JSON, as opposed to waiting on the network
+        self.parse_seconds = 0.0
+
+    def sent(self, size):
+        self.bytes_sent += size
+        app_metrics.bytes.labels(self.app, "sent").inc(size)
+
+    def received(self, size):
+        self.bytes_received += size
+        app_metrics.bytes.labels(self.app, "received").inc(size)
+
+    def parsed(self, seconds):
+        self.parse_seconds += seconds
+
+    def first_token(self):
+        """Mark the arrival of the first streamed text (recorded once per call)."""
+        if self.first_token_seconds is None:
+            self.first_token_seconds = time.perf_counter() - self.start_time
+            app_metrics.first_token_latency.labels(self.app, self.model_id).observe(self.first_token_seconds)
+
+
+@contextmanager
+def track_request(app, model_id):
+    """Time one model call and count it as in flight; errors are counted by cause.
+
+    Also opens a tracing span. Usable from both sync and async code since it never awaits.
+    """
+    start_time = time.perf_counter()
+    in_flight = app_metrics.in_flight.labels(app)
+    in_flight.inc()
+    outcome = "ok"
+    try:
+        with span(f"{app}.model_call", model=model_id):
+            yield _Call(app, model_id)
+    except Exception as e:
+        outcome = "error"
+        app_metrics.errors.labels(app, error_cause(e)).inc()
+        raise
+    finally:
+        in_flight.dec()
+        app_metrics.request_latency.labels(app, model_id, outcome).observe(time.perf_counter() - start_time)
+
+
+@contextmanager
+def track_stage(app, stage, **attributes):
+    """Time a non-model processing stage (parsing, rendering, clustering...) and trace it."""
+    start_time = time.perf_counter()
+    try:
+        with span(f"{app}.{stage}", **attributes):
+            yield
+    finally:
+        app_metrics.stage_latency.labels(app, stage).observe(time.perf_counter() - start_time)
+
+
+def record_error(app, cause):
+    app_metrics.errors.labels(app, cause).inc()
@@ -0,0 +1,196 @@
+# resilience.py
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv
+from prometheus_client import Counter, Gauge
+
+from common.metrics import error_cause, get_or_create
+
+load_dotenv()
+
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "5"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "30"))
+# Adaptive concurrency window bounds for limiters created with get_limiter()
+LIMITER_MIN_CONCURRENCY = int(os.getenv("LIMITER_MIN_CONCURRENCY", "1"))
+LIMITER_MAX_CONCURRENCY = int(os.getenv("LIMITER_MAX_CONCURRENCY", "16"))
+LIMITER_INITIAL_CONCURRENCY = int(os.getenv("LIMITER_INITIAL_CONCURRENCY", "4"))
+# Throttles within this many seconds of a decrease count as the same congestion event
+LIMITER_DECREASE_COOLDOWN = float(os.getenv("LIMITER_DECREASE_COOLDOWN", "1.0"))
+
+RETRYABLE_CAUSES = ("throttled", "server_error", "timeout", "connection")
+
+concurrency_window = get_or_create(
+    Gauge, "genai_concurrency_window", "Current adaptive concurrency window", ["limiter"]
+)
+limiter_in_flight = get_or_create(
+    Gauge, "genai_limiter_in_flight", "Calls holding an adaptive limiter slot", ["limiter"]
+)
+retries_total = get_or_create(
+    Counter, "genai_retries_total", "Model call retries by cause", ["app", "cause"]
+)
+retries_exhausted = get_or_create(
+    Counter, "genai_retries_exhausted_total", "Model calls that failed after all retries", ["app", "cause"]
+)
+
+
+def is_retryable(exc):
+    return error_cause(exc) in RETRYABLE_CAUSES
+
+
+def retry_after_seconds(exc):
+    """Server-suggested wait from a BedrockHTTPError or botocore ClientError, if any."""
+    retry_after = getattr(exc, "retry_after", None)
+    if retry_after is not None:
+        return retry_after
+    if isinstance(exc, ClientError):
+        headers = exc.response.get("ResponseMetadata", {}).get("HTTPHeaders", {})
+        try:
+            return float(headers.get("retry-after")) if headers.get("retry-after") else None
+        except ValueError:
+            return None
+    return None
+
+
+def backoff_delay(attempt, retry_after=None, base=RETRY_BASE_DELAY, cap=RETRY_MAX_DELAY):
+    """Full-jitter exponential backoff, never shorter than the server's Retry-After."""
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    return max(delay, retry_after or 0)
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit for one upstream API.
+
+    The window grows by one after a full window of successful calls and halves on
+    throttling (at most once per cooldown, so a burst of 429s is one congestion event).
+    Usable from any event loop or thread in the process.
+    """
+
+    def __init__(self, name, initial=LIMITER_INITIAL_CONCURRENCY, minimum=LIMITER_MIN_CONCURRENCY,
+                 maximum=LIMITER_MAX_CONCURRENCY):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.window = max(minimum, min(initial, maximum))
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._waiters = deque()  # (loop, future)
+        concurrency_window.labels(name).set(self.window)
+
+    def _wake(self):
+        while self._waiters and self._in_flight < self.window:
+            loop, future = self._waiters.popleft()
+            self._in_flight += 1
+            loop.call_soon_threadsafe(_grant, future)
+        limiter_in_flight.labels(self.name).set(self._in_flight)
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+            self._wake()
+
+    @asynccontextmanager
+    async def slot(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._in_flight < self.window and not self._waiters:
+                self._in_flight += 1
+                limiter_in_flight.labels(self.name).set(self._in_flight)
+                future = None
+            else:
+                future = loop.create_future()
+                self._waiters.append((loop, future))
+        if future is not None:
+            try:
+                await future
+            except asyncio.CancelledError:
+                with self._lock:
+                    if (loop, future) in self._waiters:
+                        self._waiters.remove((loop, future))
+                        future = None
+                if future is not None:
+                    # The slot was granted just as we were cancelled
+                    self._release()
+                raise
+        try:
+            yield
+        finally:
+            self._release()
+
+    def on_success(self):
+        with self._lock:
+            self._successes += 1
+            if self._successes >= self.window and self.window < self.maximum:
+                self.window += 1
+                self._successes = 0
+                concurrency_window.labels(self.name).set(self.window)
+                self._wake()
+
+    def on_throttle(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_decrease < LIMITER_DECREASE_COOLDOWN:
+                return
+            self._last_decrease = now
+            self._successes = 0
+            self.window = max(self.minimum, self.window // 2)
+            concurrency_window.labels(self.name).set(self.window)
+
+
+def _grant(future):
+    # A waiter cancelled after being granted releases its slot itself
+    if not future.done():
+        future.set_result(None)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name):
+    """Return the process-wide adaptive limiter for name, created on first use."""
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            limiter = _limiters[name] = AdaptiveLimiter(name)
+        return limiter
+
+
+async def call_with_retry(app, attempt, limiter=None, max_attempts=RETRY_MAX_ATTEMPTS,
+                          should_retry=is_retryable):
+    """Await attempt() until it succeeds, retrying throttling and transient errors.
+
+    Each attempt holds a slot of limiter (if given) and feeds its AIMD window; the
+    backoff sleep happens outside the slot.
+    """
+    for attempt_number in range(max_attempts):
+        try:
+            if limiter is None:
+                result = await attempt()
+            else:
+                async with limiter.slot():
+                    result = await attempt()
+        except Exception as e:
+            cause = error_cause(e)
+            if limiter is not None and cause == "throttled":
+                limiter.on_throttle()
+            if not should_retry(e):
+                raise
+            if attempt_number == max_attempts - 1:
+                retries_exhausted.labels(app, cause).inc()
+                raise
+            retries_total.labels(app, cause).inc()
+            await asyncio.sleep(backoff_delay(attempt_number, retry_after_seconds(e)))
+            continue
+        if limiter is not None:
+            limiter.on_success()
+        return result
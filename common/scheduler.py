@@ -0,0 +1,201 @@
+# scheduler.py
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+
+from dotenv import load_dotenv
+from prometheus_client import Gauge, Histogram
+
+from common.metrics import STAGE_BUCKETS, get_or_create
+from common.usage import current_tenant
+
+load_dotenv()
+
+# Model calls allowed in flight at once across all apps and sessions, job workers included
+MODEL_CONCURRENCY = int(os.getenv("MODEL_CONCURRENCY", "8"))
+
+# Priority classes, served in this order
+INTERACTIVE = "interactive"
+BULK = "bulk"
+PRIORITIES = (INTERACTIVE, BULK)
+
+queue_depth = get_or_create(
+    Gauge, "model_scheduler_queue_depth", "Model calls waiting for a slot", ["priority"]
+)
+active_calls = get_or_create(Gauge, "model_scheduler_active", "Model calls holding a scheduler slot")
+queue_wait = get_or_create(
+    Histogram, "model_scheduler_wait_seconds", "Time model calls waited for a slot",
+    ["app", "priority"], buckets=STAGE_BUCKETS,
+)
+
+
+class _Waiter:
+    __slots__ = ("event", "loop", "future", "granted")
+
+    def __init__(self, loop=None):
+        self.loop = loop
+        self.future = loop.create_future() if loop is not None else None
+        self.event = threading.Event() if loop is None else None
+        self.granted = False
+
+    def wake(self):
+        self.granted = True
+        if self.event is not None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class FairScheduler:
+    """Gate for model calls.
+
+    At most max_concurrency calls run at once. Waiting calls are served by priority class
+    (interactive before bulk) and, within a class, round-robin across tenants, so one
+    session's 200-page document cannot starve another session's single query.
+    attach() hands the gate to a shared instance served by common.jobs, so the app process
+    and its job workers queue in one place.
+    """
+
+    def __init__(self, max_concurrency=MODEL_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self._lock = threading.Lock()
+        self._active = 0
+        # priority -> OrderedDict(tenant -> deque of waiters); dict order is the round-robin order
+        self._queues = {priority: OrderedDict() for priority in PRIORITIES}
+        self._remote = None
+        self._remote_waits = None
+
+    def attach(self, remote):
+        """Delegate slots to remote, a proxy of the process-shared FairScheduler."""
+        if self._remote_waits is None:
+            # Async callers wait for a shared slot on these threads, not on the event loop
+            self._remote_waits = ThreadPoolExecutor(max_workers=64, thread_name_prefix="scheduler-wait")
+        self._remote = remote
+
+    def _waiting(self):
+        return any(self._queues[priority] for priority in PRIORITIES)
+
+    def _try_acquire(self, priority, tenant, waiter):
+        """Take a slot now if one is free and nobody is queued; otherwise enqueue waiter."""
+        with self._lock:
+            if self._active < self.max_concurrency and not self._waiting():
+                self._active += 1
+                active_calls.set(self._active)
+                return True
+            self._queues[priority].setdefault(tenant, deque()).append(waiter)
+            queue_depth.labels(priority).inc()
+            return False
+
+    def acquire(self, priority, tenant):
+        """Block until a slot is granted; pair with release()."""
+        waiter = _Waiter()
+        if not self._try_acquire(priority, tenant, waiter):
+            waiter.event.wait()
+
+    def release(self):
+        with self._lock:
+            self._active -= 1
+            while self._active < self.max_concurrency:
+                waiter = self._next_waiter()
+                if waiter is None:
+                    break
+                self._active += 1
+                waiter.wake()
+            active_calls.set(self._active)
+
+    def _next_waiter(self):
+        for priority in PRIORITIES:
+            tenants = self._queues[priority]
+            if not tenants:
+                continue
+            tenant, waiters = next(iter(tenants.items()))
+            waiter = waiters.popleft()
+            if waiters:
+                tenants.move_to_end(tenant)
+            else:
+                del tenants[tenant]
+            queue_depth.labels(priority).dec()
+            return waiter
+        return None
+
+    def _withdraw(self, priority, tenant, waiter):
+        """Drop a cancelled waiter; returns True if it had already been granted a slot."""
+        with self._lock:
+            if waiter.granted:
+                return True
+            waiters = self._queues[priority].get(tenant)
+            if waiters is not None and waiter in waiters:
+                waiters.remove(waiter)
+                if not waiters:
+                    del self._queues[priority][tenant]
+                queue_depth.labels(priority).dec()
+            return False
+
+    @contextmanager
+    def slot(self, app, priority, tenant=None):
+        """Hold a model-call slot for the duration of the block (blocking threads)."""
+        tenant = tenant or current_tenant()
+        start_time = time.perf_counter()
+        # A slot is given back to whichever gate granted it, even if attach() ran meanwhile
+        gate = self._remote or self
+        gate.acquire(priority, tenant)
+        queue_wait.labels(app, priority).observe(time.perf_counter() - start_time)
+        try:
+            yield
+        finally:
+            gate.release()
+
+    @asynccontextmanager
+    async def slot_async(self, app, priority, tenant=None):
+        """Async variant of slot() for coroutines on an event loop."""
+        tenant = tenant or current_tenant()
+        start_time = time.perf_counter()
+        gate = self._remote or self
+        if gate is not self:
+            # The shared gate cannot withdraw a waiter, so a cancelled caller gives the slot
+            # back once it is granted; done on the wait thread as the event loop may be gone
+            handoff = threading.Lock()
+            state = {"granted": False, "abandoned": False}
+
+            def wait():
+                gate.acquire(priority, tenant)
+                with handoff:
+                    state["granted"] = True
+                    if state["abandoned"]:
+                        gate.release()
+
+            waiting = asyncio.get_running_loop().run_in_executor(self._remote_waits, wait)
+            try:
+                await waiting
+            except asyncio.CancelledError:
+                with handoff:
+                    state["abandoned"] = True
+                    if state["granted"]:
+                        gate.release()
+                raise
+        else:
+            waiter = _Waiter(asyncio.get_running_loop())
+            if not self._try_acquire(priority, tenant, waiter):
+                try:
+                    await waiter.future
+                except asyncio.CancelledError:
+                    if self._withdraw(priority, tenant, waiter):
+                        self.release()
+                    raise
+        queue_wait.labels(app, priority).observe(time.perf_counter() - start_time)
+        try:
+            yield
+        finally:
+            gate.release()
+
+
+# Create global scheduler instance
+scheduler = FairScheduler()
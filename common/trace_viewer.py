@@ -0,0 +1,71 @@
+# trace_viewer.py
+import streamlit as st
+import plotly.graph_objects as go
+
+from common.tracing import collector
+
+
+def _ordered_spans(spans):
+    """Depth-first order so children sit under their parent in the waterfall."""
+    children = {}
+    span_ids = {s["span_id"] for s in spans}
+    roots = []
+    for s in sorted(spans, key=lambda s: s["start"]):
+        if s["parent_id"] in span_ids:
+            children.setdefault(s["parent_id"], []).append(s)
+        else:
+            roots.append(s)
+
+    ordered = []
+    stack = [(root, 0) for root in reversed(roots)]
+    while stack:
+        s, depth = stack.pop()
+        ordered.append((s, depth))
+        for child in reversed(children.get(s["span_id"], [])):
+            stack.append((child, depth + 1))
+    return ordered
+
+
+def _waterfall(spans):
+    ordered = _ordered_spans(spans)
+    trace_start = min(s["start"] for s in spans)
+    labels = [f"{'  ' * depth}{s['name']}" for s, depth in ordered]
+    offsets = [(s["start"] - trace_start) * 1000 for s, _ in ordered]
+    durations = [((s["end"] or s["start"]) - s["start"]) * 1000 for s, _ in ordered]
+    colors = ["#d62728" if s["status"] == "error" else "#1f77b4" for s, _ in ordered]
+    hover = [
+        f"{s['name']}<br>{duration:.1f} ms<br>{s['attributes']}"
+        for (s, _), duration in zip(ordered, durations)
+    ]
+
+    fig = go.Figure(
+        go.Bar(
+            y=labels, x=durations, base=offsets, orientation="h",
+            marker_color=colors, hovertext=hover, hoverinfo="text",
+        )
+    )
+    fig.update_yaxes(autorange="reversed")
+    fig.update_layout(
+        xaxis_title="ms since trace start",
+        height=max(200, 28 * len(ordered) + 80),
+        margin=dict(l=10, r=10, t=10, b=40),
+    )
+    return fig
+
+
+def trace_viewer():
+    st.title("Trace Viewer")
+    st.caption("Per-stage waterfall of recent requests across all applications.")
+
+    limit = st.slider("Number of recent traces", min_value=1, max_value=50, value=10)
+    traces = collector.recent_traces(limit)
+    if not traces:
+        st.info("No traces recorded yet. Run one of the applications first.")
+        return
+
+    for spans in traces:
+        root = min(spans, key=lambda s: s["start"])
+        total_ms = (max((s["end"] or s["start"]) for s in spans) - root["start"]) * 1000
+        status = "error" if any(s["status"] == "error" for s in spans) else "ok"
+        with st.expander(f"{root['name']} - {total_ms:.0f} ms - {len(spans)} spans - {status}"):
+            st.plotly_chart(_waterfall(spans), use_container_width=True)
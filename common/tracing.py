@@ -0,0 +1,158 @@
+# tracing.py
+import contextvars
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Finished spans are kept in memory for the last TRACE_BUFFER_SIZE traces and, unless
+# TRACE_EXPORT_PATH is empty, appended to a local JSONL file so spans from worker processes
+# are visible too.
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "50"))
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", ".cache/traces/spans.jsonl")
+TRACE_EXPORT_MAX_BYTES = int(os.getenv("TRACE_EXPORT_MAX_BYTES", str(20 * 1024 * 1024)))
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "attributes", "start", "end", "status")
+
+    def __init__(self, name, trace_id, parent_id=None, attributes=None):
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes or {}
+        self.start = time.time()
+        self.end = None
+        self.status = "ok"
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "attributes": self.attributes,
+            "start": self.start,
+            "end": self.end,
+            "status": self.status,
+            "pid": os.getpid(),
+        }
+
+
+class TraceCollector:
+    """In-process store of the most recent traces plus an optional JSONL exporter."""
+
+    def __init__(self, max_traces=TRACE_BUFFER_SIZE, export_path=TRACE_EXPORT_PATH):
+        self.max_traces = max_traces
+        self.export_path = export_path
+        self._traces = OrderedDict()
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        record = span.to_dict()
+        with self._lock:
+            spans = self._traces.setdefault(span.trace_id, [])
+            spans.append(record)
+            self._traces.move_to_end(span.trace_id)
+            while len(self._traces) > self.max_traces:
+                self._traces.popitem(last=False)
+            if self.export_path:
+                self._write(record)
+
+    def _write(self, record):
+        try:
+            os.makedirs(os.path.dirname(self.export_path) or ".", exist_ok=True)
+            if os.path.exists(self.export_path) and os.path.getsize(self.export_path) > TRACE_EXPORT_MAX_BYTES:
+                os.replace(self.export_path, self.export_path + ".1")
+            with open(self.export_path, "a") as f:
+                f.write(json.dumps(record, default=str) + "\n")
+        except OSError as e:
+            print(f"Trace export failed: {e}")
+
+    def recent_traces(self, limit=10):
+        """Return up to limit traces (newest first) as lists of span dicts."""
+        if self.export_path and os.path.exists(self.export_path):
+            traces = _read_jsonl_traces(self.export_path)
+        else:
+            with self._lock:
+                traces = OrderedDict((trace_id, list(spans)) for trace_id, spans in self._traces.items())
+        return list(reversed(list(traces.values())))[:limit]
+
+
+def _read_jsonl_traces(path, max_lines=20000):
+    traces = OrderedDict()
+    with open(path, "r") as f:
+        lines = f.readlines()[-max_lines:]
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        traces.setdefault(record["trace_id"], []).append(record)
+        traces.move_to_end(record["trace_id"])
+    return traces
+
+
+# Create global collector instance
+collector = TraceCollector()
+
+
+def current_span():
+    return _current_span.get()
+
+
+@contextmanager
+def span(name, **attributes):
+    """Open a span as a child of the current one (or start a new trace)."""
+    parent = _current_span.get()
+    new_span = Span(
+        name,
+        trace_id=parent.trace_id if parent else uuid.uuid4().hex,
+        parent_id=parent.span_id if parent else None,
+        attributes=attributes,
+    )
+    token = _current_span.set(new_span)
+    try:
+        yield new_span
+    except Exception as e:
+        new_span.status = "error"
+        new_span.attributes["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        new_span.end = time.time()
+        _current_span.reset(token)
+        collector.export(new_span)
+
+
+def traced(name=None):
+    """Decorator that wraps a sync or async function in a span."""
+    def decorator(func):
+        span_name = name or f"{func.__module__}.{func.__qualname__}"
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,310 @@
+# usage.py
+import asyncio
+import contextvars
+import itertools
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+from prometheus_client import Counter, Histogram
+
+from common.metrics import get_or_create
+
+load_dotenv()
+
+# Tokens per minute allowed per tenant (Streamlit session); 0 disables throttling
+TOKEN_BUDGET_TPM = int(os.getenv("TOKEN_BUDGET_TPM", "0"))
+BUDGET_WINDOW_SECONDS = 60.0
+
+# USD per 1,000 tokens (input, output)
+MODEL_PRICES = {
+    "anthropic.claude-3-5-sonnet-20240620-v1:0": (0.003, 0.015),
+    "mistral.mistral-large-2402-v1:0": (0.004, 0.012),
+    "amazon.titan-embed-text-v1": (0.0001, 0.0),
+}
+# Rough input-token cost of one page image at Claude's default resolution
+IMAGE_TOKENS = 1600
+
+_tenant = contextvars.ContextVar("usage_tenant", default=None)
+_capture = contextvars.ContextVar("usage_capture", default=None)
+
+tokens_total = get_or_create(
+    Counter, "genai_tokens_total", "Model tokens by app, model and direction", ["app", "model", "direction"]
+)
+cost_total = get_or_create(Counter, "genai_cost_usd_total", "Estimated model cost in USD", ["app", "model"])
+budget_wait = get_or_create(
+    Histogram, "genai_budget_wait_seconds", "Time spent waiting for token budget", ["app"],
+    buckets=(0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 120),
+)
+
+
+def current_tenant():
+    """Tenant for accounting and budgets: the active scope, else the Streamlit session id."""
+    tenant = _tenant.get()
+    if tenant:
+        return tenant
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+        ctx = get_script_run_ctx(suppress_warning=True)
+        if ctx is not None:
+            return ctx.session_id
+    except ImportError:
+        pass
+    return "default"
+
+
+@contextmanager
+def tenant_scope(tenant):
+    """Attribute all model calls made inside the block (including tasks and threads) to tenant."""
+    token = _tenant.set(tenant)
+    try:
+        yield
+    finally:
+        _tenant.reset(token)
+
+
+def estimate_tokens(text="", images=0, max_output_tokens=0, image_tokens=IMAGE_TOKENS):
+    """Cheap pre-call estimate used to reserve budget (about 4 characters per token)."""
+    return len(text) // 4 + images * image_tokens + max_output_tokens
+
+
+def usage_from_response(headers=None, body=None):
+    """Read (input_tokens, output_tokens) from Bedrock response headers or body."""
+    headers = {k.lower(): v for k, v in (headers or {}).items()}
+    if "x-amzn-bedrock-input-token-count" in headers:
+        return (
+            int(headers["x-amzn-bedrock-input-token-count"]),
+            int(headers.get("x-amzn-bedrock-output-token-count", 0)),
+        )
+    body = body or {}
+    if "usage" in body:
+        return body["usage"].get("input_tokens", 0), body["usage"].get("output_tokens", 0)
+    if "inputTextTokenCount" in body:
+        return body["inputTextTokenCount"], 0
+    return None
+
+
+class _Capture:
+    def __init__(self):
+        self.input_tokens = None
+        self.output_tokens = None
+
+
+@contextmanager
+def capture_usage():
+    """Collect token counts from boto3 calls made by libraries we do not control (langchain)."""
+    captured = _Capture()
+    token = _capture.set(captured)
+    try:
+        yield captured
+    finally:
+        _capture.reset(token)
+
+
+def capture_headers(headers):
+    captured = _capture.get()
+    if captured is None:
+        return
+    usage = usage_from_response(headers)
+    if usage is not None:
+        captured.input_tokens = (captured.input_tokens or 0) + usage[0]
+        captured.output_tokens = (captured.output_tokens or 0) + usage[1]
+
+
+def register_usage_hook(client):
+    """Feed InvokeModel response headers of a real boto3 client into capture_usage()."""
+    def _after_call(http_response=None, **kwargs):
+        if http_response is not None:
+            capture_headers(dict(http_response.headers))
+
+    client.meta.events.register("after-call.bedrock-runtime.InvokeModel", _after_call)
+
+
+class UsageTracker:
+    """Aggregates tokens, bytes and cost per app and per (app, tenant)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_app = defaultdict(lambda: defaultdict(float))
+        self._by_tenant = defaultdict(lambda: defaultdict(float))
+
+    def record(self, app, model_id, input_tokens, output_tokens, bytes_sent=0, bytes_received=0, tenant=None,
+               reservation=None):
+        """Account one model call; reservation (from budget.acquire) is settled with its actual tokens."""
+        tenant = tenant or current_tenant()
+        input_price, output_price = MODEL_PRICES.get(model_id, (0.0, 0.0))
+        cost = input_tokens / 1000 * input_price + output_tokens / 1000 * output_price
+
+        tokens_total.labels(app, model_id, "input").inc(input_tokens)
+        tokens_total.labels(app, model_id, "output").inc(output_tokens)
+        cost_total.labels(app, model_id).inc(cost)
+        with self._lock:
+            for totals in (self._by_app[app], self._by_tenant[(app, tenant)]):
+                totals["calls"] += 1
+                totals["input_tokens"] += input_tokens
+                totals["output_tokens"] += output_tokens
+                totals["bytes_sent"] += bytes_sent
+                totals["bytes_received"] += bytes_received
+                totals["cost_usd"] += cost
+        budget.settle(reservation, input_tokens + output_tokens)
+
+    def merge(self, tenant, per_app):
+        """Add totals recorded in another process (a job worker) for tenant."""
+        with self._lock:
+            for app, delta in per_app.items():
+                for totals in (self._by_app[app], self._by_tenant[(app, tenant)]):
+                    for key, value in delta.items():
+                        totals[key] += value
+
+    def by_app(self):
+        with self._lock:
+            return {app: dict(totals) for app, totals in self._by_app.items()}
+
+    def for_tenant(self, tenant):
+        with self._lock:
+            return {app: dict(totals) for (app, t), totals in self._by_tenant.items() if t == tenant}
+
+
+class TokenBudget:
+    """Sliding one-minute tokens-per-minute allowance per tenant.
+
+    acquire() reserves an estimate before a model call and returns a reservation id.
+    The caller settles it with the actual count once the call returns (usage_tracker.record
+    does this) and releases it in a finally block, so a failed call gives its estimate
+    back. attach() points the budget at a shared instance served by common.jobs, so job
+    worker processes and the app process draw from the same allowance.
+    """
+
+    def __init__(self, tokens_per_minute=TOKEN_BUDGET_TPM):
+        self.tokens_per_minute = tokens_per_minute
+        self._lock = threading.Lock()
+        self._windows = defaultdict(deque)  # tenant -> deque of [timestamp, tokens]
+        self._open = {}  # reservation id -> (tenant, window entry)
+        self._ids = itertools.count(1)
+        self._remote = None
+
+    def attach(self, remote):
+        """Delegate reservations to remote, a proxy of the process-shared TokenBudget."""
+        self._remote = remote
+
+    def _used(self, window, now):
+        while window and now - window[0][0] > BUDGET_WINDOW_SECONDS:
+            window.popleft()
+        return sum(entry[1] for entry in window)
+
+    def try_reserve(self, tenant, tokens):
+        """Reserve tokens if they fit and return (0, reservation id), else (seconds to wait, None)."""
+        if self._remote is not None:
+            return self._remote.try_reserve(tenant, tokens)
+        now = time.time()
+        with self._lock:
+            window = self._windows[tenant]
+            used = self._used(window, now)
+            # A single call larger than the whole allowance may run once the window is empty
+            if used + tokens <= self.tokens_per_minute or not window:
+                entry = [now, tokens]
+                window.append(entry)
+                # Prefixed with the pid so ids from a shared budget never match local ones
+                reservation = f"{os.getpid()}:{next(self._ids)}"
+                self._open[reservation] = (tenant, entry)
+                return 0.0, reservation
+            return max(0.05, BUDGET_WINDOW_SECONDS - (now - window[0][0])), None
+
+    def acquire(self, app, tokens, tenant=None):
+        """Wait until tokens fit the tenant's allowance; returns a reservation id (None when disabled)."""
+        if self.tokens_per_minute <= 0:
+            return None
+        tenant = tenant or current_tenant()
+        start_time = time.perf_counter()
+        while True:
+            delay, reservation = self.try_reserve(tenant, tokens)
+            if not delay:
+                break
+            time.sleep(min(delay, 1.0))
+        budget_wait.labels(app).observe(time.perf_counter() - start_time)
+        return reservation
+
+    async def acquire_async(self, app, tokens, tenant=None):
+        if self.tokens_per_minute <= 0:
+            return None
+        tenant = tenant or current_tenant()
+        start_time = time.perf_counter()
+        while True:
+            delay, reservation = self.try_reserve(tenant, tokens)
+            if not delay:
+                break
+            await asyncio.sleep(min(delay, 1.0))
+        budget_wait.labels(app).observe(time.perf_counter() - start_time)
+        return reservation
+
+    def settle(self, reservation, actual_tokens):
+        """Replace a reservation's estimate with the tokens the call actually used."""
+        if reservation is None:
+            return
+        if self._remote is not None and reservation not in self._open:
+            self._remote.settle(reservation, actual_tokens)
+            return
+        with self._lock:
+            item = self._open.pop(reservation, None)
+            if item is not None:
+                item[1][1] = actual_tokens
+
+    def release(self, reservation):
+        """Give back a reservation that was not settled (the call failed); no-op once settled."""
+        if reservation is None:
+            return
+        if self._remote is not None and reservation not in self._open:
+            self._remote.release(reservation)
+            return
+        with self._lock:
+            item = self._open.pop(reservation, None)
+            if item is not None:
+                tenant, entry = item
+                window = self._windows[tenant]
+                for index, candidate in enumerate(window):
+                    if candidate is entry:
+                        del window[index]
+                        break
+
+    def remaining(self, tenant):
+        if self.tokens_per_minute <= 0:
+            return None
+        if self._remote is not None:
+            return self._remote.remaining(tenant)
+        with self._lock:
+            return max(0, self.tokens_per_minute - self._used(self._windows[tenant], time.time()))
+
+
+# Create global instances
+budget = TokenBudget()
+usage_tracker = UsageTracker()
+
+
+def usage_sidebar():
+    """Show this session's token usage and budget in the Streamlit sidebar."""
+    import streamlit as st
+
+    tenant = current_tenant()
+    per_app = usage_tracker.for_tenant(tenant)
+    with st.sidebar.expander("Model usage (this session)"):
+        if not per_app:
+            st.caption("No model calls yet.")
+        total_cost = 0.0
+        for app, totals in sorted(per_app.items()):
+            total_cost += totals["cost_usd"]
+            st.write(
+                f"**{app}**: {int(totals['calls'])} calls, "
+                f"{int(totals['input_tokens']):,} in / {int(totals['output_tokens']):,} out tokens"
+            )
+        if per_app:
+            st.write(f"Estimated cost: ${total_cost:.4f}")
+        remaining = budget.remaining(tenant)
+        if remaining is not None:
+            st.progress(
+                remaining / budget.tokens_per_minute,
+                text=f"{remaining:,} of {budget.tokens_per_minute:,} tokens/min left",
+            )
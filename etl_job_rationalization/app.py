@@ -7,53 +7,69 @@ from sklearn.decomposition import PCA
 from yellowbrick.cluster import KElbowVisualizer
 import plotly.express as px
 import os
+from common.jobs import get_job_manager, poll_job
+from common.metrics import track_stage
 
-def etl_rationalization_main():
-    # Set page configuration (optional if set globally)
-    # st.set_page_config(page_title="ETL Workflows Rationalization", layout="wide")
-    st.title("ETL Workflows Rationalization")
-    st.subheader("Upload your CSV files for clustering analysis.")
-
-    # Helper functions
-    def perform_pca(df):
+# Helper functions
+def perform_pca(df):
+    with track_stage("etl", "perform_pca"):
         features_encoded = pd.get_dummies(df)
         features_standardized = StandardScaler().fit_transform(features_encoded)
         pca = PCA(n_components=2)
         features_pca = pca.fit_transform(features_standardized)
-        return features_pca
-
-    def plot_elbow_curve(X):
+    return features_pca
 
+def plot_elbow_curve(X):
     # Define the directory and file path
-        static_dir = "static/images"
-        plot_path = os.path.join(static_dir, "elbow_curve_plot.png")
-        
-        # Ensure the directory exists
-        os.makedirs(static_dir, exist_ok=True)
-
-        # Create the elbow plot
+    static_dir = "static/images"
+    plot_path = os.path.join(static_dir, "elbow_curve_plot.png")
+    
+    # Ensure the directory exists
+    os.makedirs(static_dir, exist_ok=True)
+
+    # Create the elbow plot
+    with track_stage("etl", "plot_elbow_curve"):
         model = KMeans(random_state=39)
         visualizer = KElbowVisualizer(model, k=(2, 15), timings=False)
         visualizer.fit(X)
         visualizer.show(outpath=plot_path)  # Save the plot to the specified path
 
-        return plot_path, visualizer.elbow_value_
+    return plot_path, visualizer.elbow_value_
 
-    def kmeans_clustering(df, features_pca, no_clusters):
+def kmeans_clustering(df, features_pca, no_clusters):
+    with track_stage("etl", "kmeans_clustering"):
         kmeans = KMeans(n_clusters=no_clusters, random_state=39)
         df['Cluster ID'] = kmeans.fit_predict(features_pca)
         silhouette_avg = silhouette_score(features_pca, df['Cluster ID'])
-        return df, silhouette_avg
-
-    def cluster_plot(df, features_pca):
-        fig = px.scatter(
-            x=features_pca[:, 0],
-            y=features_pca[:, 1],
-            color=df['Cluster ID'].astype(str),
-            title="Cluster Visualization",
-            labels={'x': 'PC1', 'y': 'PC2'},
-        )
-        st.plotly_chart(fig)
+    return df, silhouette_avg
+
+def clustering_job(job, df):
+    # Runs in the job pool (common.jobs); the elbow sweep fits 13 KMeans models
+    job.progress(0, 3, message="Reducing dimensions")
+    features_pca = perform_pca(df)
+    job.progress(1, 3, message="Finding optimal number of clusters")
+    _, optimal_clusters = plot_elbow_curve(features_pca)
+    job.progress(2, 3, message="Clustering workflows")
+    clustered_df, silhouette_avg = kmeans_clustering(df, features_pca, optimal_clusters)
+    job.progress(3, 3)
+    return clustered_df, features_pca, optimal_clusters, silhouette_avg
+
+def cluster_plot(df, features_pca):
+    fig = px.scatter(
+        x=features_pca[:, 0],
+        y=features_pca[:, 1],
+        color=df['Cluster ID'].astype(str),
+        title="Cluster Visualization",
+        labels={'x': 'PC1', 'y': 'PC2'},
+    )
+    st.plotly_chart(fig)
+
+
+def etl_rationalization_main():
+    # Set page configuration (optional if set globally)
+    # st.set_page_config(page_title="ETL Workflows Rationalization", layout="wide")
+    st.title("ETL Workflows Rationalization")
+    st.subheader("Upload your CSV files for clustering analysis.")
 
     # Initialize session state
     if "clustered_df" not in st.session_state:
@@ -76,16 +92,23 @@ def etl_rationalization_main():
 
         st.subheader("Clustering Analysis")
         if st.button("Perform Clustering"):
-            try:
-                features_pca = perform_pca(combined_df)
-                elbow_plot_path, optimal_clusters = plot_elbow_curve(features_pca)
+            st.session_state["clustering_job"] = get_job_manager().submit(
+                clustering_job, combined_df, label="ETL clustering"
+            )
+
+        job_id = st.session_state.get("clustering_job")
+        if job_id:
+            status = poll_job(job_id, label="Clustering workflows...")
+            if status["status"] == "done":
+                clustered_df, features_pca, optimal_clusters, silhouette_avg = get_job_manager().result(job_id)
                 st.session_state["optimal_clusters"] = optimal_clusters
                 st.session_state["features_pca"] = features_pca
-                clustered_df, silhouette_avg = kmeans_clustering(combined_df, features_pca, optimal_clusters)
                 st.session_state["clustered_df"] = clustered_df
                 st.session_state["silhouette_avg"] = silhouette_avg
-            except Exception as e:
-                st.error(f"An error occurred: {str(e)}")
+            elif status["status"] == "failed":
+                st.error(f"An error occurred: {status['error']}")
+            get_job_manager().forget(job_id)
+            st.session_state["clustering_job"] = None
 
     if st.session_state["clustered_df"] is not None:
         st.subheader("Clustering Analysis Results")
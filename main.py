@@ -1,13 +1,28 @@
 import streamlit as st
-from brd_master.app import run as run_brd
-from code_switch.app import main as run_codeswitch
-from ImageRAG.app import main as run_imagerag
-from etl_job_rationalization.app import etl_rationalization_main
-from resume_mapping.main import resume_mapping
-import subprocess
-import os
+import importlib
+import logging
+import sys
 import time
 
+from common.metrics import start_exporter
+from common.tracing import span
+from common.usage import current_tenant, tenant_scope, usage_sidebar
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Sidebar choice -> (module path, entry point). Modules are imported on first
+# selection only, so opening "Home" does not pull in torch, ColPali, sklearn,
+# faiss or boto3.
+APP_REGISTRY = {
+    "BRD Test Master": ("brd_master.app", "run"),
+    "Code Switch": ("code_switch.app", "main"),
+    "Image RAG": ("ImageRAG.app", "main"),
+    "ETL Job Rationalisation": ("etl_job_rationalization.app", "etl_rationalization_main"),
+    "Resume Mapping": ("resume_mapping.main", "resume_mapping"),
+    "Trace Viewer": ("common.trace_viewer", "trace_viewer"),
+}
+
 # Streamlit Page Configuration
 st.set_page_config(
     page_title="Combined App",
@@ -54,26 +69,39 @@ def home_page():
     # Add separator
     st.markdown("---")
 
+def load_app(app_choice):
+    """Import the module behind a sidebar choice and return its entry point."""
+    module_path, entry_point = APP_REGISTRY[app_choice]
+    if module_path not in sys.modules:
+        start_time = time.perf_counter()
+        importlib.import_module(module_path)
+        logger.info(
+            "Loaded %s (%s) in %.2fs",
+            app_choice, module_path, time.perf_counter() - start_time
+        )
+    return getattr(sys.modules[module_path], entry_point)
+
 # Main Function
 def main():
+    start_exporter()  # One Prometheus exporter per process, scraped via brd_master/prometheus.yml
     st.sidebar.title("Task Panel")
     app_choice = st.sidebar.radio(
         "Choose Application",
-        ["Home", "BRD Test Master", "Code Switch", "Image RAG", "ETL Job Rationalisation", "Resume Mapping"]
+        ["Home"] + list(APP_REGISTRY)
     )
+    usage_sidebar()
 
     if app_choice == "Home":
         home_page()
-    elif app_choice == "BRD Test Master":
-        run_brd()
-    elif app_choice == "Code Switch":
-        run_codeswitch()
-    elif app_choice == "Image RAG":
-        run_imagerag()
-    elif app_choice == "ETL Job Rationalisation":
-        etl_rationalization_main()
-    elif app_choice == "Resume Mapping":
-        resume_mapping()
+    else:
+        with st.spinner(f"Loading {app_choice}..."):
+            run_app = load_app(app_choice)
+        if app_choice == "Trace Viewer":
+            run_app()
+        else:
+            # Root span per rerun; time not covered by child spans is Streamlit rendering
+            with span(f"app:{app_choice}"), tenant_scope(current_tenant()):
+                run_app()
 
 if __name__ == "__main__":
     main()
@@ -1,17 +1,16 @@
-import boto3
-import os
 import json
 import streamlit as st
+from common.bedrock import get_bedrock_client as get_shared_bedrock_client, invoke_model
+from common.metrics import track_request
+from common.scheduler import BULK, scheduler
+from common.usage import budget, estimate_tokens, usage_tracker
+
+EMBEDDING_MODEL_ID = "amazon.titan-embed-text-v1"
 
 def get_bedrock_client():
-    """Create AWS Bedrock client with error handling."""
+    """Return the shared AWS Bedrock client with error handling."""
     try:
-        return boto3.client(
-            service_name='bedrock-runtime',
-            region_name=os.getenv("AWS_REGION"),
-            aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-            aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY")
-        )
+        return get_shared_bedrock_client()
     except Exception as e:
         st.error(f"Error creating Bedrock client: {str(e)}")
         st.stop()
@@ -20,12 +19,17 @@ def get_titan_embedding(text, bedrock_client):
     """Use Amazon Titan for text embeddings with robust error handling."""
     try:
         body = json.dumps({"inputText": text})
-        response = bedrock_client.invoke_model(
-            modelId="amazon.titan-embed-text-v1",
-            body=body,
-            contentType="application/json"
-        )
-        response_body = json.loads(response['body'].read().decode('utf-8'))
+        reservation = budget.acquire("resume_mapping", estimate_tokens(text))
+        try:
+            with scheduler.slot("resume_mapping", BULK), track_request("resume_mapping", EMBEDDING_MODEL_ID) as call:
+                response_body, usage = invoke_model(EMBEDDING_MODEL_ID, body, call=call, client=bedrock_client)
+            input_tokens, output_tokens = usage or (estimate_tokens(text), 0)
+            usage_tracker.record(
+                "resume_mapping", EMBEDDING_MODEL_ID, input_tokens, output_tokens,
+                call.bytes_sent, call.bytes_received, reservation=reservation,
+            )
+        finally:
+            budget.release(reservation)
         return response_body['embedding']
     except Exception as e:
         st.warning(f"Embedding generation error: {str(e)}")
@@ -8,10 +8,45 @@ from dotenv import load_dotenv
 from resume_mapping.embeddings import get_bedrock_client, get_titan_embedding
 from resume_mapping.resume_analysis import sync_process_resumes, display_detailed_analysis
 from resume_mapping.utils import parse_pdf_to_text, create_faiss_index
+from common.jobs import get_job_manager, poll_job
 
 # Load environment variables
 load_dotenv()
 
+def match_resumes_job(job, job_description, resumes):
+    """Job entry point (common.jobs): embed, rank and analyze parsed resumes in a worker."""
+    bedrock_client = get_bedrock_client()
+
+    # Generate Job Description Embedding
+    job.progress(0, len(resumes) + 1, message="Generating embeddings...")
+    job_embedding = get_titan_embedding(job_description, bedrock_client)
+    if job_embedding is None:
+        raise RuntimeError("Failed to generate embedding for the job description.")
+
+    embedded = []
+    resume_embeddings = []
+    skipped = []
+    for done, resume in enumerate(resumes, start=1):
+        embedding = get_titan_embedding(resume["resume_text"], bedrock_client)
+        if embedding is None:
+            skipped.append(resume["filename"])
+        else:
+            embedded.append(resume)
+            resume_embeddings.append(embedding)
+        job.progress(done, len(resumes) + 1, message="Generating embeddings...")
+
+    if not embedded:
+        return [], skipped
+
+    # Build FAISS Index and Search
+    index = create_faiss_index(np.array(resume_embeddings, dtype='float32'))
+    distances, indices = index.search(np.array([job_embedding], dtype='float32'), len(embedded))
+
+    # Analyze Results
+    job.progress(len(resumes), len(resumes) + 1, message="Analyzing resumes...")
+    results = sync_process_resumes(job_description, embedded, distances, indices)
+    return results, skipped
+
 # Main Function for Resume Mapping
 def resume_mapping():
     # Set a title for this specific feature
@@ -34,22 +69,8 @@ def resume_mapping():
             return
 
         try:
-            # Initialize Bedrock Client
-            st.info("Initializing AWS Bedrock Client...")
-            bedrock_client = get_bedrock_client()
-
-            # Generate Job Description Embedding
-            st.info("Generating embeddings for the job description...")
-            job_embedding = get_titan_embedding(job_description, bedrock_client)
-            if job_embedding is None:
-                st.error("Failed to generate embedding for the job description.")
-                return
-
             # Process Resumes
             resumes = []
-            resume_embeddings = []
-
-            st.info("Processing resumes and generating embeddings...")
             for uploaded_file in uploaded_files:
                 resume_text = parse_pdf_to_text(uploaded_file)
 
@@ -57,29 +78,35 @@ def resume_mapping():
                     st.warning(f"No text found in {uploaded_file.name}. Skipping...")
                     continue
 
-                embedding = get_titan_embedding(resume_text, bedrock_client)
-                if embedding is None:
-                    st.warning(f"Skipping {uploaded_file.name} due to embedding failure.")
-                    continue
-
                 resumes.append({"filename": uploaded_file.name, "resume_text": resume_text})
-                resume_embeddings.append(embedding)
 
             if not resumes:
                 st.error("No valid resumes processed. Please check your inputs.")
                 return
 
-            # Build FAISS Index and Search
-            st.info("Building FAISS index and performing similarity search...")
-            index = create_faiss_index(np.array(resume_embeddings, dtype='float32'))
-            distances, indices = index.search(np.array([job_embedding], dtype='float32'), len(resumes))
-
-            # Analyze Results
-            st.info("Analyzing resumes...")
-            results = sync_process_resumes(job_description, resumes, distances, indices)
-            display_detailed_analysis(results)
+            # Embeddings, similarity search and analysis run in the job pool
+            st.session_state["resume_job"] = get_job_manager().submit(
+                match_resumes_job, job_description, resumes, label="Resume matching"
+            )
 
         except Exception as e:
             st.error("An unexpected error occurred while processing resumes.")
             st.error(str(e))
             st.error(traceback.format_exc())
+
+    job_id = st.session_state.get("resume_job")
+    if job_id:
+        status = poll_job(job_id, label="Processing resumes...")
+        if status["status"] == "done":
+            results, skipped = get_job_manager().result(job_id)
+            for filename in skipped:
+                st.warning(f"Skipping {filename} due to embedding failure.")
+            if results:
+                display_detailed_analysis(results)
+            else:
+                st.error("No valid resumes processed. Please check your inputs.")
+        elif status["status"] == "failed":
+            st.error("An unexpected error occurred while processing resumes.")
+            st.error(status["error"])
+        get_job_manager().forget(job_id)
+        st.session_state["resume_job"] = None
@@ -1,19 +1,19 @@
-import boto3
-import os
 import json
 import streamlit as st
 import asyncio
 import pandas as pd
 import numpy as np
+from common.bedrock import get_bedrock_client, invoke_model_async
+from common.llm_cache import llm_cache, make_key
+from common.metrics import record_error, track_request
+from common.scheduler import BULK, scheduler
+from common.usage import budget, estimate_tokens, usage_tracker
+
+MODEL_ID = "anthropic.claude-3-5-sonnet-20240620-v1:0"
 
 async def analyze_resume_with_claude(job_description, resume_text, similarity_percentage):
     """Asynchronous resume analysis with improved error handling and parsing."""
-    bedrock_client = boto3.client(
-        service_name="bedrock-runtime",
-        region_name=os.getenv("AWS_REGION"),
-        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY")
-    )
+    bedrock_client = get_bedrock_client()
 
     prompt = f"""
     You are analyzing resumes for a job description. Given the job description and resume content below, perform the following:
@@ -46,21 +46,36 @@ async def analyze_resume_with_claude(job_description, resume_text, similarity_pe
         "messages": [{"role": "user", "content": prompt}]
     })
 
+    cache_key = make_key(MODEL_ID, {}, body)
+    cached_analysis = llm_cache.get("resume_mapping", cache_key)
+    if cached_analysis is not None:
+        return cached_analysis
+
     try:
-        response = await asyncio.to_thread(
-            bedrock_client.invoke_model,
-            modelId="anthropic.claude-3-5-sonnet-20240620-v1:0",
-            body=body,
-            contentType="application/json"
-        )
+        reservation = await budget.acquire_async("resume_mapping", estimate_tokens(prompt, max_output_tokens=500))
+        try:
+            async with scheduler.slot_async("resume_mapping", BULK):
+                with track_request("resume_mapping", MODEL_ID) as call:
+                    response_body, usage = await invoke_model_async(
+                        MODEL_ID, body, call=call, client=bedrock_client
+                    )
 
-        response_body = json.loads(response['body'].read().decode('utf-8'))
+            input_tokens, output_tokens = usage or (0, 0)
+            usage_tracker.record(
+                "resume_mapping", MODEL_ID, input_tokens, output_tokens,
+                call.bytes_sent, call.bytes_received, reservation=reservation,
+            )
+        finally:
+            budget.release(reservation)
         content_text = response_body.get("content", [{}])[0].get("text", "{}")
         
         # Try to parse the JSON, with fallback
         try:
-            return json.loads(content_text)
+            analysis = json.loads(content_text)
+            llm_cache.set("resume_mapping", cache_key, analysis)
+            return analysis
         except json.JSONDecodeError:
+            record_error("resume_mapping", "parse_error")
             st.warning(f"Invalid JSON response: {content_text}")
             return {
                 "Matched Percentage": "0.00%",
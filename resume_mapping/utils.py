@@ -1,13 +1,16 @@
 import streamlit as st
-from PyPDF2 import PdfReader
 import faiss
 import numpy as np
+from common.documents import documents
+from common.metrics import track_stage
 
 def parse_pdf_to_text(pdf_file):
     """Extract text from a PDF with error handling."""
     try:
-        reader = PdfReader(pdf_file)
-        text = " ".join([page.extract_text() for page in reader.pages if page.extract_text()])
+        with track_stage("resume_mapping", "parse_pdf_to_text", file=getattr(pdf_file, "name", None)):
+            doc_id = documents.register(pdf_file)
+            pages = [documents.page_text(doc_id, n) for n in range(documents.page_count(doc_id))]
+            text = " ".join(page for page in pages if page.strip())
         return text.strip()
     except Exception as e:
         st.warning(f"PDF parsing error for {pdf_file.name}: {str(e)}")
@@ -16,9 +19,10 @@ def parse_pdf_to_text(pdf_file):
 def create_faiss_index(embeddings):
     """Create FAISS index for embeddings with error handling."""
     try:
-        dimension = len(embeddings[0])
-        index = faiss.IndexFlatL2(dimension)
-        index.add(np.array(embeddings))
+        with track_stage("resume_mapping", "create_faiss_index"):
+            dimension = len(embeddings[0])
+            index = faiss.IndexFlatL2(dimension)
+            index.add(np.array(embeddings))
         return index
     except Exception as e:
         st.error(f"FAISS index creation error: {str(e)}")